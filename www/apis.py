@@ -5,6 +5,9 @@
 Error definition
 """
 
+import json
+import base64
+
 __author__ = 'Will Wei'
 
 
@@ -34,6 +37,65 @@ class Page(object):
     __repr__ = __str__
 
 
+class CursorPage(object):
+    """
+    Keyset pagination on (created_at, id), which costs one index range scan at any depth.
+    The next/previous cursors are opaque tokens made by encode_cursor().
+    """
+    def __init__(self, items, page_size=10, has_more=False, backward=False, cursor=None, key='created_at'):
+        """
+        Init Pagination by the items of this page, fetched with Model.findSeek().
+        """
+        self.page_size = page_size
+        self.item_count = len(items)
+        if backward:
+            # 向前翻页：更新的一侧由has_more决定，更旧的一侧必然存在
+            self.has_previous = has_more
+            self.has_next = len(items) > 0
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None and len(items) > 0
+        self.next_cursor = encode_cursor(items[-1][key], items[-1]['id']) if self.has_next else ''
+        self.previous_cursor = encode_cursor(items[0][key], items[0]['id'], True) if self.has_previous else ''
+
+    def __str__(self):
+        return 'item_count: %s, page_size: %s, next_cursor: %s, previous_cursor: %s' % (self.item_count, self.page_size, self.next_cursor, self.previous_cursor)
+
+    __repr__ = __str__
+
+
+def encode_cursor(key, id, backward=False):
+    """
+    Encode the position (key, id) into an opaque url-safe cursor.
+    """
+    s = json.dumps(['b' if backward else 'a', key, id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(s.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _is_scalar(value):
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+def decode_cursor(cursor):
+    """
+    Decode the cursor into (after, before) for Model.findSeek().
+    Empty cursor means the first page. Raise APIValueError if the cursor is invalid.
+    """
+    if not cursor:
+        return None, None
+    try:
+        s = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        direction, key, id = json.loads(s)
+    except Exception:
+        raise APIValueError('cursor', 'Invalid cursor.')
+    # 只接受标量，避免把列表、对象作为SQL参数
+    if direction not in ('a', 'b') or not _is_scalar(key) or not _is_scalar(id):
+        raise APIValueError('cursor', 'Invalid cursor.')
+    if direction == 'b':
+        return None, (key, id)
+    return (key, id), None
+
+
 class APIError(Exception):
     """
     the base APIError
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+apis.py 中分页游标的测试
+运行: python3 apis_test.py 或 pytest apis_test.py
+"""
+
+import json
+import base64
+from apis import encode_cursor, decode_cursor, APIValueError
+
+__author__ = 'Will Wei'
+
+
+# 不经过encode_cursor构造游标，value为bytes时直接编码
+def raw_cursor(value):
+    if not isinstance(value, bytes):
+        value = json.dumps(value).encode('utf-8')
+    return base64.urlsafe_b64encode(value).decode('ascii').rstrip('=')
+
+
+def assert_invalid(cursor):
+    try:
+        decode_cursor(cursor)
+    except APIValueError as e:
+        assert e.data == 'cursor'
+    else:
+        assert False, 'APIValueError not raised for %r' % cursor
+
+
+def test_empty_cursor():
+    assert decode_cursor(None) == (None, None)
+    assert decode_cursor('') == (None, None)
+
+
+def test_round_trip():
+    for key, id in [(1500000000.5, '001'), (0, 'a'), ('名字', '0015-abc'), (-1, '')]:
+        assert decode_cursor(encode_cursor(key, id)) == ((key, id), None)
+        assert decode_cursor(encode_cursor(key, id, backward=True)) == (None, (key, id))
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor('?/+&=' * 10, '~~~')
+    assert all(c.isalnum() or c in '-_' for c in cursor)
+
+
+def test_reject_bad_encoding():
+    for cursor in ['!!!', 'a', raw_cursor(b'\xff\xfe'), raw_cursor(b'not json')]:
+        assert_invalid(cursor)
+
+
+def test_reject_bad_shape():
+    for value in [[], ['a', 1], ['a', 1, 'x', 2], {'a': 1}, 'a', 1, None]:
+        assert_invalid(raw_cursor(value))
+
+
+def test_reject_bad_direction():
+    for direction in ['c', '', None, 1]:
+        assert_invalid(raw_cursor([direction, 1, 'x']))
+
+
+def test_reject_non_scalar_values():
+    for value in [[1], {'a': 1}, None, True]:
+        assert_invalid(raw_cursor(['a', value, 'x']))
+        assert_invalid(raw_cursor(['b', 1, value]))
+
+
+if __name__ == '__main__':
+    for name, fn in sorted(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print('%s ==> ok' % name)
@@ -7,22 +7,37 @@ async web application.
 
 import asyncio
 import os
-import json
 import time
+import signal
+import stat
+import functools
 import orm
+import serializer
+import compress
+import metrics
+from fragment_cache import FragmentCacheExtension
+from prefork import Supervisor, bind_socket, bind_unix_socket
 from datetime import datetime
 from aiohttp import web
-from jinja2 import Environment, FileSystemLoader
-from coroweb import add_routes, add_static
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+from coroweb import add_routes, add_static, static_url, make_etag, etag_matches
 from config import configs
-from handlers import cookie2user, COOKIE_NAME
+from versions import content_version
+from handlers import cookie2user, page_cache, metrics_response, COOKIE_NAME
 import logging
-# 日志级别关系：CRITICAL > ERROR > WARNING > INFO > DEBUG > NOTSET
-logging.basicConfig(level=logging.INFO)
+from logs import init_logging, stop_logging, access_log
 
 __author__ = 'Will Wei'
 
 
+# 字节码缓存目录中的文件会被加载执行，目录必须属于当前用户且其他用户不可访问(0700)
+def check_private_dir(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or stat.S_IMODE(st.st_mode) & 0o077:
+        raise RuntimeError('bytecode cache directory %s must be a directory owned by the current user with mode 0700.' % path)
+
+
 # 初始化jinja2，配置jinja2环境
 def init_jinja2(app, **kw):
     logging.info('init jinja2...')
@@ -36,8 +51,20 @@ def init_jinja2(app, **kw):
         variable_start_string=kw.get('variable_start_string', '{{'),
         variable_end_string=kw.get('variable_end_string', '}}'),
         # 模板修改后，下次请求是否重新加载
-        auto_reload=kw.get('auto_reload', True)
+        auto_reload=kw.get('auto_reload', True),
+        # jinja2扩展
+        extensions=kw.get('extensions', ())
     )
+    # 字节码缓存，多个进程共用，进程启动时不必重新编译模板
+    # 为True时使用jinja2默认的临时目录(按用户创建并检查属主)，为字符串时使用该目录
+    bytecode_cache = kw.get('bytecode_cache', None)
+    if bytecode_cache is True:
+        options['bytecode_cache'] = FileSystemBytecodeCache()
+        logging.info('set jinja2 bytecode cache: %s' % options['bytecode_cache'].directory)
+    elif bytecode_cache:
+        check_private_dir(bytecode_cache)
+        options['bytecode_cache'] = FileSystemBytecodeCache(bytecode_cache)
+        logging.info('set jinja2 bytecode cache: %s' % bytecode_cache)
     path = kw.get('path', None)
     if path is None:
         path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
@@ -48,29 +75,131 @@ def init_jinja2(app, **kw):
     if filters is not None:
         for name, f in filters.items():
             env.filters[name] = f
+    # 模板中可以直接调用的全局函数
+    env.globals.update(kw.get('globals', {}))
+    # 启动时预编译全部模板，第一个请求不需要编译
+    if kw.get('precompile', False):
+        for name in env.list_templates(filter_func=lambda n: n.endswith('.html')):
+            env.get_template(name)
+        logging.info('precompiled jinja2 templates: %s' % len(env.list_templates()))
     # app中添加__templating__保存env，这样app就知道要去哪找模板，怎么解析模板
     app['__templating__'] = env
 
 
-# 日志处理，请求时输出请求方法和路径
+# 访问日志，请求结束后记录方法、路径、状态码和耗时，按configs.logging.access_sample抽样
 async def logger_factory(app, handler):
     async def logger(request):
-        logging.info('Request: %s %s' % (request.method, request.path))
-        return (await handler(request))
+        start = time.time()
+        status = 500
+        resp = None
+        try:
+            resp = await handler(request)
+            status = resp.status
+            return resp
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            size = resp.content_length if resp is not None else None
+            access_log(request, status, time.time() - start, size, configs.logging.access_sample, configs.logging.slow_request_ms)
     return logger
 
 
+# 统计本请求执行的SQL条数和耗时，保存在request.__query_stats__，由访问日志输出
+# debug模式下通过Server-Timing响应头返回，可在浏览器开发者工具中查看，并检查N+1查询
+async def query_stats_factory(app, handler):
+    async def query_stats(request):
+        start = time.time()
+        request.__query_stats__, token = orm.begin_query_stats()
+        try:
+            resp = await handler(request)
+        finally:
+            orm.end_query_stats(token)
+        stats = request.__query_stats__
+        if stats is not None:
+            stats.handler = getattr(request, '__handler__', None)
+            orm.check_n_plus_one(stats)
+        if configs.debug and stats is not None and isinstance(resp, web.StreamResponse) and not resp.prepared:
+            resp.headers['Server-Timing'] = 'db;dur=%.1f;desc="%s queries", total;dur=%.1f' % (stats.elapsed * 1000, stats.count, (time.time() - start) * 1000)
+        return resp
+    return query_stats
+
+
+# 指标采集，记录进行中的请求数，以及按路由、方法和状态码统计的请求数和耗时
+async def metrics_factory(app, handler):
+    async def collect(request):
+        start = time.time()
+        status = 500
+        metrics.http_requests_in_flight.inc()
+        try:
+            resp = await handler(request)
+            status = resp.status
+            return resp
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            metrics.http_requests_in_flight.dec()
+            route = metrics.route_name(request)
+            metrics.http_request_duration.observe(time.time() - start, (route, request.method))
+            metrics.http_requests.inc((route, request.method, str(status)))
+    return collect
+
+
+# 响应压缩，根据Accept-Encoding选择br(已安装brotli时)或gzip
+# 只压缩大于min_size的文本类响应，ETag加上编码后缀，压缩结果由compress.cache缓存
+async def compress_factory(app, handler):
+    async def compress_response(request):
+        resp = await handler(request)
+        # 304响应沿用客户端缓存的压缩版本的ETag
+        if resp.status == 304 and 'ETag' in resp.headers:
+            tag = resp.headers['ETag']
+            for encoding in ('gzip', 'br'):
+                if '%s-%s"' % (tag[:-1], encoding) in request.headers.get('If-None-Match', ''):
+                    resp.headers['ETag'] = '%s-%s"' % (tag[:-1], encoding)
+            return resp
+        if type(resp) is not web.Response or resp.status != 200 or not resp.body:
+            return resp
+        if 'Content-Encoding' in resp.headers or not compress.compressible(resp.headers.get('Content-Type')):
+            return resp
+        resp.headers.add('Vary', 'Accept-Encoding')
+        encoding = compress.choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None or len(resp.body) < configs.compress.min_size:
+            return resp
+        tag = resp.headers.get('ETag')
+        # 只缓存GET响应的压缩结果，其他请求的响应体通常只出现一次
+        cache_tag = tag if request.method == 'GET' else None
+        resp.body = await compress.compress_cached(asyncio.get_event_loop(), resp.body, encoding, cache_tag)
+        resp.headers['Content-Encoding'] = encoding
+        if tag:
+            resp.headers['ETag'] = '%s-%s"' % (tag[:-1], encoding)
+        return resp
+    return compress_response
+
+
+# 请求范围的身份映射，configs.orm.identity_map为True时启用，放在auth_factory之前
+# 同一请求中再次查询同一行时返回同一个对象，orm.unit_of_work装饰的处理函数返回后写入修改过的对象
+async def session_factory(app, handler):
+    async def session(request):
+        request.__session__, token = orm.begin_session()
+        try:
+            return (await handler(request))
+        finally:
+            orm.end_session(token)
+    return session
+
+
 # 利用middle在处理URL之前，把cookie解析出来，并将登录用户绑定到request对象上，后续的URL处理函数就可以直接拿到登录用户
 async def auth_factory(app, handler):
     async def auth(request):
-        logging.info('check user: %s %s' % (request.method, request.path))
+        logging.debug('check user: %s %s', request.method, request.path)
         request.__user__ = None
         cookie_str = request.cookies.get(COOKIE_NAME)
         if cookie_str:
             # 验证cookie，并得到用户信息
             user = await cookie2user(cookie_str)
             if user:
-                logging.info('set current user: %s' % user.email)
+                logging.debug('set current user: %s', user.email)
                 request.__user__ = user
         # # 如果请求路径是管理页面，但是用户不是管理员，将重定向到登陆页面
         if request.path.startswith('/manage/') and (request.__user__ is None or not request.__user__.admin):
@@ -79,16 +208,62 @@ async def auth_factory(app, handler):
     return auth
 
 
+# 条件GET，为GET请求的200响应加上ETag，与If-None-Match匹配时返回304
+# 处理函数通过coroweb.check_etag设置了request.__etag__时使用它，否则使用响应内容的哈希
+async def etag_factory(app, handler):
+    async def etag(request):
+        request.__etag__ = None
+        resp = await handler(request)
+        if request.method not in ('GET', 'HEAD'):
+            return resp
+        tag = request.__etag__
+        if resp.status == 304 and tag:
+            resp.headers['ETag'] = tag
+            return resp
+        if type(resp) is not web.Response or resp.status != 200 or not resp.body:
+            return resp
+        if tag is None:
+            tag = make_etag(resp.body)
+        if etag_matches(request, tag):
+            return web.Response(status=304, headers={'ETag': tag})
+        resp.headers['ETag'] = tag
+        return resp
+    return etag
+
+
+# 匿名访问的整页缓存，放在response_factory之前
+# 只缓存没有awesession cookie的GET请求的200响应，key为path和查询字符串
+async def page_cache_factory(app, handler):
+    async def cache(request):
+        if request.method != 'GET' or COOKIE_NAME in request.cookies:
+            return (await handler(request))
+        key = (request.path, request.query_string)
+        # 缓存项带有渲染前的内容版本，其他worker写入后版本改变，缓存项作废
+        # 渲染过程中发生的写入也会使本次结果作废
+        version = content_version()
+        cached = page_cache.get(key)
+        if cached is not None and cached[3] == version:
+            body, content_type, request.__etag__, version = cached
+            return web.Response(body=body, headers={'Content-Type': content_type})
+        resp = await handler(request)
+        # 不缓存重定向、错误、文件、设置了cookie和Cache-Control: no-store的响应
+        if type(resp) is web.Response and resp.status == 200 and resp.body and not resp.cookies \
+                and 'no-store' not in resp.headers.get('Cache-Control', ''):
+            page_cache.set(key, (resp.body, resp.headers.get('Content-Type'), getattr(request, '__etag__', None), version))
+        return resp
+    return cache
+
+
 # 数据处理，请求为post时起作用
 async def data_factory(app, handler):
     async def parse_data(request):
         if request.method == 'POST':
             if request.content_type.startswith('application/json'):
                 request.__data__ = await request.json()
-                logging.info('request json: %s' % str(request.__data__))
+                logging.debug('request json: %s', request.__data__)
             elif request.content_type.startswith('application/x-www-form-urlencoded'):
                 request.__data__ = await request.post()
-                logging.info('request form: %s' % str(request.__data__))
+                logging.debug('request form: %s', request.__data__)
         return (await handler(request))
     return parse_data
 
@@ -104,7 +279,7 @@ async def data_factory(app, handler):
 # 注：在response_factory中应用了jinja2来渲染模板文件
 async def response_factory(app, handler):
     async def response(request):
-        logging.info('Response handler...')
+        logging.debug('Response handler...')
         r = await handler(request)
         # 如果相应结果为StreamResponse，直接返回
         # StreamResponse是aiohttp定义response的基类
@@ -130,7 +305,7 @@ async def response_factory(app, handler):
             template = r.get('__template__')
             # 若不存在对应模板，则将字典调整为json格式返回，并设置响应类型为json
             if template is None:
-                resp = web.Response(body=json.dumps(r, ensure_ascii=False, default=lambda o: o.__dict__).encode('utf-8'))
+                resp = web.Response(body=serializer.dumps(r))
                 resp.content_type = 'application/json;charset=utf-8'
                 return resp
             else:
@@ -170,18 +345,109 @@ def datetime_filter(t):
     return u'%s年%s月%s日' % (dt.year, dt.month, dt.day)
 
 
-async def init(loop):   # async替代@asyncio.coroutine装饰器，表示这是个异步运行的函数
+async def init(loop, sock, unix_sock=None):   # async替代@asyncio.coroutine装饰器，表示这是个异步运行的函数
+    orm.configure(**configs.orm)
+    # N+1查询检测只在debug模式下开启
+    if not configs.debug:
+        orm.configure(n_plus_one_threshold=0)
+    # 每个进程有自己的连接池，大小由configs.db.maxsize/minsize指定
     await orm.create_pool(loop=loop, **configs.db)
+    # 每条SQL的耗时和行数记录到/metrics，连接池状态在输出时采集
+    orm.add_query_hook(metrics.observe_query)
+    metrics.collectors.append(metrics.collect_pool_stats)
     # loop=loop是处理用户参数用的，访问量少不添加代码照样运行，高并发时就会出问题
     # middlewares(中间件)设置3个中间处理函数(装饰器)
-    app = web.Application(loop=loop, middlewares=[logger_factory, auth_factory, response_factory])
-    init_jinja2(app, filters=dict(datetime=datetime_filter))
+    middlewares = [logger_factory, query_stats_factory, metrics_factory, compress_factory, auth_factory, etag_factory, page_cache_factory, response_factory]
+    if configs.orm.identity_map:
+        middlewares.insert(middlewares.index(auth_factory), session_factory)
+    app = web.Application(loop=loop, middlewares=middlewares)
+    # 生产模式：关闭模板修改检查，使用字节码缓存，启动时预编译模板
+    production = configs.templates.production
+    init_jinja2(app, filters=dict(datetime=datetime_filter), globals=dict(static=static_url),
+                extensions=[FragmentCacheExtension],
+                auto_reload=not production, precompile=production,
+                bytecode_cache=(configs.templates.bytecode_cache or True) if production else None)
     add_routes(app, 'handlers')
     add_static(app)
-    srv = await loop.create_server(app.make_handler(), '127.0.0.1', 9000)   # await替代yield from，表示要放入loop中进行的异步操作
-    logging.info('server started at http://127.0.0.1:9000...')
+    # 关闭aiohttp自带的访问日志，由logger_factory按抽样比例记录
+    handler = app.make_handler(keepalive_timeout=configs.server.keepalive_timeout, access_log=None)
+    # sock由run()或supervisor创建，create_server会再次调用listen()，需要传入backlog，否则使用默认的100
+    srvs = [await loop.create_server(handler, sock=sock, backlog=configs.server.backlog)]   # await替代yield from，表示要放入loop中进行的异步操作
+    logging.info('server started at http://%s:%s (pid %s)...' % (configs.server.host, configs.server.port, os.getpid()))
+    if unix_sock is not None:
+        srvs.append(await loop.create_unix_server(handler, sock=unix_sock, backlog=configs.server.backlog))
+        logging.info('server started at unix:%s (pid %s)...' % (configs.server.unix_socket, os.getpid()))
+    if configs.metrics.port:
+        srvs.append(await init_metrics_server(loop))
+    return app, handler, srvs
+
+
+# 单独的/metrics监听，只用于指标抓取，不经过中间件
+# 每个worker监听configs.metrics.port + worker序号，抓取配置中列出每个worker的端口
+async def init_metrics_server(loop):
+    async def get_metrics(request):
+        return metrics_response()
+    app = web.Application(loop=loop)
+    app.router.add_route('GET', '/metrics', get_metrics)
+    handler = app.make_handler(access_log=None)
+    port = configs.metrics.port + int(metrics.worker_label())
+    srv = await loop.create_server(handler, configs.metrics.host, port)
+    logging.info('metrics server started at http://%s:%s/metrics (pid %s)...' % (configs.metrics.host, port, os.getpid()))
     return srv
 
-loop = asyncio.get_event_loop()    # 获取asyncio event loop
-loop.run_until_complete(init(loop))    # 用asyncio event loop来异步运行init()
-loop.run_forever()
+
+# 停止服务：不再接受新连接，等待进行中的请求完成，关闭连接池
+async def shutdown(app, handler, srvs):
+    for srv in srvs:
+        srv.close()
+        await srv.wait_closed()
+    await app.shutdown()
+    await handler.shutdown(configs.server.shutdown_timeout)
+    await app.cleanup()
+    await orm.destory_pool()
+    logging.info('server stopped (pid %s).' % os.getpid())
+
+
+# 创建event loop，configs.server.uvloop为True且已安装uvloop时使用uvloop
+def new_event_loop():
+    if configs.server.uvloop:
+        try:
+            import uvloop
+            return uvloop.new_event_loop()
+        except ImportError:
+            logging.warning('uvloop is not installed, using asyncio event loop.')
+    return asyncio.new_event_loop()
+
+
+# 运行一个服务进程，收到SIGTERM时停止
+def run(sock=None, unix_sock=None):
+    # fork出的子进程需要启动自己的日志线程
+    init_logging(configs.logging.level)
+    if sock is None:
+        sock = bind_socket(configs.server.host, configs.server.port, False, configs.server.backlog)
+    loop = new_event_loop()    # 每个进程创建自己的event loop
+    asyncio.set_event_loop(loop)
+    app, handler, srvs = loop.run_until_complete(init(loop, sock, unix_sock))    # 用asyncio event loop来异步运行init()
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(shutdown(app, handler, srvs))
+        loop.close()
+        # 写出队列中剩余的日志，supervisor的子进程用os._exit退出，不会执行atexit
+        stop_logging()
+
+
+if __name__ == '__main__':
+    init_logging(configs.logging.level)
+    # workers为0时按CPU核数启动，为1时在当前进程中运行
+    workers = configs.server.workers or os.cpu_count()
+    # Unix domain socket在fork前创建，所有进程共用
+    unix_sock = bind_unix_socket(configs.server.unix_socket, configs.server.backlog) if configs.server.unix_socket else None
+    if workers == 1:
+        run(unix_sock=unix_sock)
+    else:
+        Supervisor(functools.partial(run, unix_sock=unix_sock), workers, configs.server.host, configs.server.port,
+                   configs.server.reuse_port, configs.server.backlog).run()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+静态文件打包
+把static目录复制到dist/static，文件名加上内容哈希(如js/vue.min.1a2b3c4d.js)，
+文本类文件生成.gz预压缩文件，并生成manifest.json(原文件名 => 带哈希的文件名)
+css中引用的字体、图片也替换为带哈希的文件名
+$ python3 build_static.py
+"""
+
+import os
+import re
+import gzip
+import json
+import shutil
+import hashlib
+
+__author__ = 'Will Wei'
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dist', 'static')
+MANIFEST = 'manifest.json'
+
+# 生成.gz的文件类型，woff、png等已压缩的格式不处理
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.txt', '.json', '.ttf', '.otf', '.eot')
+
+_RE_CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+_RE_URL_SUFFIX = re.compile(r'([^?#]*)(.*)')
+
+
+def log(s):
+    print('[Static] %s' % s)
+
+
+def fingerprint(rel, data):
+    name, ext = os.path.splitext(rel)
+    return '%s.%s%s' % (name, hashlib.md5(data).hexdigest()[:8], ext)
+
+
+# 把css中相对路径的url(...)替换为带哈希的文件名，保留?和#后缀
+def rewrite_css(rel, data, manifest):
+    base = os.path.dirname(rel)
+
+    def repl(m):
+        url = m.group(2)
+        if url.startswith(('data:', 'http:', 'https:', '//', '/')):
+            return m.group(0)
+        path, suffix = _RE_URL_SUFFIX.match(url).groups()
+        target = os.path.normpath(os.path.join(base, path)).replace(os.sep, '/')
+        if target not in manifest:
+            return m.group(0)
+        new = os.path.relpath(manifest[target], base or '.').replace(os.sep, '/')
+        return 'url(%s%s%s%s)' % (m.group(1), new, suffix, m.group(1))
+    return _RE_CSS_URL.sub(repl, data.decode('utf-8')).encode('utf-8')
+
+
+def write(rel, data):
+    path = os.path.join(DIST, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if rel.endswith(COMPRESSIBLE):
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9))
+
+
+def build():
+    files = []
+    for root, dirs, names in os.walk(SRC):
+        for name in names:
+            if name.startswith('.'):
+                continue
+            files.append(os.path.relpath(os.path.join(root, name), SRC).replace(os.sep, '/'))
+    if os.path.isdir(DIST):
+        shutil.rmtree(DIST)
+    manifest = dict()
+    # 先处理css以外的文件，css中的引用需要用到它们的哈希文件名
+    for rel in sorted(files, key=lambda f: f.endswith('.css')):
+        with open(os.path.join(SRC, rel), 'rb') as f:
+            data = f.read()
+        if rel.endswith('.css'):
+            data = rewrite_css(rel, data, manifest)
+        manifest[rel] = fingerprint(rel, data)
+        # 原文件名也保留一份，未使用static()的引用仍然可用
+        write(rel, data)
+        write(manifest[rel], data)
+        log('%s => %s' % (rel, manifest[rel]))
+    with open(os.path.join(DIST, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    log('%s files built to %s' % (len(manifest), DIST))
+
+
+if __name__ == '__main__':
+    build()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+In-process cache
+"""
+
+import sys
+import time
+from collections import OrderedDict
+
+__author__ = 'Will Wei'
+
+
+class LRUCache(object):
+    """
+    LRU cache with a bounded number of entries and an optional ttl (seconds).
+    If maxbytes is given, the total sys.getsizeof() of the values is bounded too.
+    Expired entries are dropped when they are read.
+    """
+    def __init__(self, maxsize=1024, ttl=None, maxbytes=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        value, expires = item
+        if expires is not None and expires < time.time():
+            self.remove(key)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        if self.maxbytes is not None and sys.getsizeof(value) > self.maxbytes:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        self.remove(key)
+        self._data[key] = (value, time.time() + ttl if ttl is not None else None)
+        if self.maxbytes is not None:
+            self.bytes += sys.getsizeof(value)
+        while len(self._data) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+            self.remove(next(iter(self._data)))
+
+    def remove(self, key):
+        item = self._data.pop(key, None)
+        if item is not None and self.maxbytes is not None:
+            self.bytes -= sys.getsizeof(item[0])
+
+    # 删除所有满足条件的项，fn(key, value)返回True时删除
+    def remove_if(self, fn):
+        for key in [k for k, (v, e) in self._data.items() if fn(k, v)]:
+            self.remove(key)
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __str__(self):
+        return 'size: %s, maxsize: %s, bytes: %s, maxbytes: %s, hits: %s, misses: %s' % (len(self._data), self.maxsize, self.bytes, self.maxbytes, self.hits, self.misses)
+
+    __repr__ = __str__
+
+
+class PageCache(LRUCache):
+    """
+    Rendered responses keyed by (path, query_string).
+    invalidate(path) drops the path with all of its query strings.
+    """
+    def invalidate(self, *paths):
+        paths = set(paths)
+        self.remove_if(lambda key, value: key[0] in paths)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+cache.py 的测试
+运行: python3 cache_test.py 或 pytest cache_test.py
+"""
+
+import sys
+import cache
+from cache import LRUCache
+
+__author__ = 'Will Wei'
+
+
+class Clock(object):
+    """
+    Replace time in the cache module, advance() moves the clock forward.
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def __enter__(self):
+        self._saved = cache.time
+        cache.time = self
+        return self
+
+    def __exit__(self, *exc):
+        cache.time = self._saved
+
+
+def test_lru_eviction():
+    c = LRUCache(2)
+    c.set('a', 1)
+    c.set('b', 2)
+    assert c.get('a') == 1
+    # b最久未使用，被淘汰
+    c.set('c', 3)
+    assert c.get('b') is None and c.get('a') == 1 and c.get('c') == 3
+    assert len(c) == 2
+    assert (c.hits, c.misses) == (3, 1)
+
+
+def test_zero_size_does_not_cache():
+    c = LRUCache(0)
+    c.set('a', 1)
+    assert c.get('a') is None and len(c) == 0
+
+
+def test_ttl():
+    with Clock() as clock:
+        c = LRUCache(10, ttl=60)
+        c.set('a', 1)
+        c.set('b', 2, 10)
+        c.set('c', 3, 0)
+        clock.advance(5)
+        assert c.get('a') == 1 and c.get('b') == 2
+        assert c.get('c') is None
+        clock.advance(10)
+        assert c.get('a') == 1
+        assert c.get('b', 'expired') == 'expired'
+        clock.advance(60)
+        assert c.get('a') is None
+        # 过期的项在读取时删除
+        assert len(c) == 0
+
+
+def test_no_ttl():
+    with Clock() as clock:
+        c = LRUCache(10)
+        c.set('a', 1)
+        clock.advance(10 ** 9)
+        assert c.get('a') == 1
+
+
+def test_maxbytes():
+    size = sys.getsizeof(b'x' * 100)
+    c = LRUCache(10, maxbytes=size * 3)
+    for key in 'abc':
+        c.set(key, b'x' * 100)
+    assert c.bytes == size * 3
+    c.get('a')
+    # 超过总字节数时淘汰最久未使用的项
+    c.set('d', b'x' * 100)
+    assert c.get('b') is None and c.get('a') is not None
+    assert c.bytes == size * 3
+    # 替换已有的项不重复计算
+    c.set('a', b'x' * 100)
+    assert c.bytes == size * 3
+    c.remove('a')
+    assert c.bytes == size * 2
+    c.clear()
+    assert c.bytes == 0
+
+
+def test_maxbytes_rejects_large_value():
+    c = LRUCache(10, maxbytes=1000)
+    c.set('a', b'x' * 100)
+    c.set('b', b'x' * 1000)
+    assert c.get('b') is None and c.get('a') is not None
+
+
+def test_remove_if():
+    c = LRUCache(10)
+    for i in range(5):
+        c.set('k%s' % i, i)
+    c.remove_if(lambda key, value: value % 2 == 0)
+    assert sorted(c._data) == ['k1', 'k3']
+
+
+if __name__ == '__main__':
+    for name, fn in sorted(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print('%s ==> ok' % name)
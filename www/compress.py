@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Response compression
+"""
+
+import gzip
+from cache import LRUCache
+from config import configs
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__author__ = 'Will Wei'
+
+
+# 压缩的响应类型
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+# 压缩结果缓存，key为(ETag, 编码)，按总字节数限制大小
+cache = LRUCache(configs.compress.cache_size, maxbytes=configs.compress.cache_bytes)
+
+
+# 判断响应类型是否需要压缩
+def compressible(content_type):
+    return content_type is not None and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+# 根据Accept-Encoding选择编码，优先br，其次gzip，都不接受时返回None
+def choose_encoding(accept_encoding):
+    if not accept_encoding:
+        return None
+    accepted = set()
+    for item in accept_encoding.lower().split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip()
+        q = 1.0
+        for p in parts[1:]:
+            p = p.strip()
+            if p.startswith('q='):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(coding)
+    if brotli is not None and configs.compress.brotli and ('br' in accepted or '*' in accepted):
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=configs.compress.brotli_quality)
+    return gzip.compress(body, compresslevel=configs.compress.gzip_level)
+
+
+# 压缩并按ETag缓存结果，没有tag时只压缩不缓存
+# 大于executor_size的内容在线程池中压缩，不阻塞event loop
+async def compress_cached(loop, body, encoding, tag=None):
+    key = (tag, encoding)
+    data = cache.get(key) if tag else None
+    if data is None:
+        if len(body) >= configs.compress.executor_size:
+            data = await loop.run_in_executor(None, compress, body, encoding)
+        else:
+            data = compress(body, encoding)
+        if tag:
+            cache.set(key, data)
+    return data
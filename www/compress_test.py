@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+compress.py 的测试
+运行: python3 compress_test.py 或 pytest compress_test.py
+"""
+
+import compress
+from compress import choose_encoding
+
+__author__ = 'Will Wei'
+
+
+class Brotli(object):
+    """
+    Set compress.brotli as if brotli is (or is not) installed.
+    """
+    def __init__(self, installed):
+        self.installed = installed
+
+    def __enter__(self):
+        self._saved = compress.brotli
+        compress.brotli = object() if self.installed else None
+
+    def __exit__(self, *exc):
+        compress.brotli = self._saved
+
+
+def test_no_accept_encoding():
+    assert choose_encoding(None) is None
+    assert choose_encoding('') is None
+    assert choose_encoding('identity') is None
+
+
+def test_gzip_q_values():
+    with Brotli(False):
+        assert choose_encoding('gzip') == 'gzip'
+        assert choose_encoding('deflate, GZIP;q=0.5') == 'gzip'
+        assert choose_encoding('gzip;q=0') is None
+        assert choose_encoding('gzip; q=0.0, deflate') is None
+        # 无法解析的q值视为不接受
+        assert choose_encoding('gzip;q=abc') is None
+        assert choose_encoding('*') == 'gzip'
+        assert choose_encoding('br') is None
+
+
+def test_br_preferred_when_installed():
+    with Brotli(True):
+        assert choose_encoding('gzip, deflate, br') == 'br'
+        assert choose_encoding('br;q=0.1, gzip') == 'br'
+        assert choose_encoding('br;q=0, gzip') == 'gzip'
+        assert choose_encoding('*') == 'br'
+
+
+if __name__ == '__main__':
+    for name, fn in sorted(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print('%s ==> ok' % name)
@@ -15,9 +15,105 @@ configs = {
         'port': 3306,
         'user': 'root',
         'password': '111111',
-        'db': 'awesome'
+        'db': 'awesome',
+        # 每个进程的连接池大小
+        'maxsize': 10,
+        'minsize': 1
+    },
+    'logging': {
+        'level': 'INFO',
+        # 访问日志的抽样比例，1表示全部记录
+        'access_sample': 0.1,
+        # 超过此毫秒数的请求总是记录
+        'slow_request_ms': 500
+    },
+    'server': {
+        'host': '127.0.0.1',
+        'port': 9000,
+        # 进程数，0表示按CPU核数，1表示单进程
+        'workers': 1,
+        # 多进程时各进程用SO_REUSEPORT绑定同一端口，不支持时共用父进程的socket
+        'reuse_port': True,
+        # 停止时等待进行中的请求完成的秒数
+        'shutdown_timeout': 60,
+        # 已安装uvloop时使用uvloop的event loop
+        'uvloop': False,
+        # 监听队列长度
+        'backlog': 128,
+        # keep-alive连接的空闲超时秒数
+        'keepalive_timeout': 75,
+        # 同时监听的Unix domain socket路径，供本机反向代理使用，为空时不监听
+        'unix_socket': ''
     },
     'session': {
         'secret': 'Awesome'
+    },
+    'metrics': {
+        # 单独的/metrics监听端口，每个worker使用port + worker序号，0表示不监听
+        # 公开端口上的/metrics只允许管理员访问
+        'host': '127.0.0.1',
+        'port': 0
+    },
+    'auth_cache': {
+        # 缓存的已登录cookie数，0表示不缓存
+        # 经过orm修改users表时所有worker的缓存作废，不经过orm修改口令要等ttl过期
+        'size': 1024,
+        # 缓存秒数
+        'ttl': 300
+    },
+    'templates': {
+        # 生产模式：不检查模板修改，使用字节码缓存，启动时预编译全部模板
+        'production': False,
+        # 字节码缓存目录，必须属于运行用户且权限为0700，为空时使用jinja2按用户创建的临时目录
+        'bytecode_cache': ''
+    },
+    'fragment_cache': {
+        # 缓存的模板片段数，0表示不缓存
+        # 与page_cache相同，经过orm的写入使所有worker的片段作废
+        'size': 1000,
+        # 默认缓存秒数
+        'ttl': 60
+    },
+    'page_cache': {
+        # 匿名访问缓存的页面数，0表示不缓存
+        # 经过orm的写入通过共享的表版本使所有worker的缓存作废，不经过orm的写入(如render_blogs.py)要等ttl过期
+        'size': 1000,
+        # 缓存秒数
+        'ttl': 60
+    },
+    'compress': {
+        # 小于此字节数的响应不压缩
+        'min_size': 1024,
+        # 大于此字节数的响应在线程池中压缩
+        'executor_size': 64 * 1024,
+        'gzip_level': 6,
+        # 已安装brotli时优先使用br编码
+        'brotli': True,
+        'brotli_quality': 5,
+        # 压缩结果缓存，只缓存带ETag的GET响应
+        'cache_size': 1024,
+        'cache_bytes': 32 * 1024 * 1024
+    },
+    'markdown_cache': {
+        # 缓存的渲染结果数
+        'maxsize': 4096,
+        # 缓存的html总字节数
+        'maxbytes': 64 * 1024 * 1024
+    },
+    'orm': {
+        # count查询结果缓存秒数，0表示不缓存
+        'count_cache_ttl': 60,
+        # 缓存的count查询结果数
+        'count_cache_size': 1024,
+        # 超过此毫秒数的SQL记录到慢查询日志(只记录参数类型)，0表示不记录
+        'slow_query_ms': 100,
+        # debug模式下，一个请求中同一语句以不同参数执行超过此次数时警告N+1查询，0表示不检测
+        'n_plus_one_threshold': 5,
+        # 检测到N+1查询时请求失败(返回500)，用于测试
+        'n_plus_one_strict': False,
+        # 请求范围的身份映射，同一请求中同一行只查询一次
+        'identity_map': False,
+        # 分页总数使用information_schema中的近似行数，不扫描表
+        'approximate_count': False
     }
 }
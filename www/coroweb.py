@@ -10,6 +10,9 @@ import os
 import inspect
 import functools
 import logging
+import json
+import mimetypes
+import hashlib
 
 from urllib import parse
 from aiohttp import web
@@ -109,6 +112,90 @@ def has_request_arg(fn):
     return found
 
 
+# 解析一个类型为application/x-www-form-urlencoded的查询字符串
+# urllib.parse.parse_qsl(qs, keep_blank_values=False, ...)返回[(k, v), ...]
+# 同名变量取第一个值，如wd=python&ie=utf-8返回{'wd': 'python', 'ie': 'utf-8'}
+def parse_query(qs):
+    kw = dict()
+    for k, v in parse.parse_qsl(qs, True):
+        if k not in kw:
+            kw[k] = v
+    return kw
+
+
+# 由响应内容或版本信息计算强ETag
+def make_etag(*parts):
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else repr(part).encode('utf-8'))
+    return '"%s"' % h.hexdigest()
+
+
+# 判断请求的If-None-Match是否与etag匹配
+def etag_matches(request, etag):
+    inm = request.headers.get('If-None-Match')
+    if not inm:
+        return False
+    for tag in inm.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        # 压缩后的响应ETag带有编码后缀，如"xxx-gzip"
+        if tag.endswith('-gzip"') or tag.endswith('-br"'):
+            tag = tag[:tag.rindex('-')] + '"'
+        if tag == '*' or tag == etag:
+            return True
+    return False
+
+
+# 条件GET：处理函数用低成本的版本信息(如最新记录的created_at)计算ETag
+# 与If-None-Match匹配时返回True，处理函数可以不执行查询直接返回304
+# 计算出的ETag保存在request.__etag__，由app.etag_factory写入响应
+def check_etag(request, *version):
+    etag = make_etag(request.path, request.query_string, *version)
+    request.__etag__ = etag
+    return etag_matches(request, etag)
+
+
+# 根据URL处理函数的签名生成参数绑定函数，在add_route时生成一次，每个请求只做必要的工作
+# bind(request, params)把请求参数params(可为None)和match_info合并为调用fn的关键字参数
+# 返回(kw, None)，缺少必需参数时返回(None, 参数名)
+def make_binder(fn):
+    has_request = has_request_arg(fn)
+    has_var_kw = has_var_kw_arg(fn)
+    named_kw_args = frozenset(get_named_kw_args(fn))
+    required_kw_args = get_required_kw_args(fn)
+    # 只有接收关键字参数的函数才需要解析查询字符串或消息主体
+    wants_params = bool(has_var_kw or named_kw_args or required_kw_args)
+    # 没有**kw时，移除kw中不是fn关键字参数的项
+    filter_params = not has_var_kw and bool(named_kw_args)
+
+    def bind(request, params):
+        match_info = request.match_info
+        if params is None:
+            kw = dict(match_info)
+        else:
+            if filter_params:
+                kw = {k: v for k, v in params.items() if k in named_kw_args}
+            else:
+                kw = params
+            # kw中加入match_info中的值
+            for k, v in match_info.items():
+                if k in kw:
+                    logging.warning('Duplicate arg name in named arg and kw args: %s' % k)
+                kw[k] = v
+        if has_request:
+            kw['request'] = request
+        # 检查kw是否包含全部没有默认值的关键字参数
+        for name in required_kw_args:
+            if name not in kw:
+                return None, name
+        return kw, None
+
+    bind.wants_params = wants_params
+    return bind
+
+
 # 从URL处理函数中分析需要接收的参数，从request中获取必要的参数
 # 调用URL函数，然后把结果转换为web.Response
 class RequestHandler(object):
@@ -117,74 +204,50 @@ class RequestHandler(object):
     def __init__(self, app, fn):
         self._app = app
         self._func = fn
-        self._has_request_arg = has_request_arg(fn)
-        self._has_var_kw_arg = has_var_kw_arg(fn)
-        self._has_named_kw_args = has_named_kw_args(fn)
-        self._named_kw_args = get_named_kw_args(fn)
-        self._required_kw_args = get_required_kw_args(fn)
+        self._bind = make_binder(fn)
+
+    # 解析请求参数，POST为消息主体，GET为查询字符串
+    # 返回dict或None，请求格式错误时返回web.HTTPBadRequest
+    async def _read_params(self, request):
+        # POST
+        if request.method == 'POST':
+            if not request.content_type:
+                return web.HTTPBadRequest(text='Missing Content-type.')
+            ct = request.content_type.lower()
+            # application/json表示消息主体是序列化后的json字符串
+            if ct.startswith('application/json'):
+                params = await request.json()
+                if not isinstance(params, dict):
+                    return web.HTTPBadRequest(text='JSON body must be object.')
+                return params
+            # 消息主体是表单
+            if ct.startswith('application/x-www-form-urlencoded') or ct.startswith('multipart/form-data'):
+                params = await request.post()
+                return dict(**params)
+            return web.HTTPBadRequest(text='Unsupported Content-Type: %s' % request.content_type)
+        # GET
+        if request.method == 'GET':
+            # query_string表示url中的查询字符串，即?后面的请求参数
+            # https://www.baidu.com/s?wd=python&ie=utf-8
+            # wd=python&ie=utf-8即为查询字符串
+            qs = request.query_string
+            if qs:
+                return parse_query(qs)
+        return None
 
     # 定义__call__参数后，其实例可以被视为函数
     async def __call__(self, request):
-        kw = None  # 用于保存参数
-        # 判断是否存在参数
-        if self._has_var_kw_arg or self._has_named_kw_args or self._required_kw_args:
-            # POST
-            if request.method == 'POST':
-                if not request.content_type:
-                    return web.HTTPBadRequest(text='Missing Content-type.')
-                ct = request.content_type.lower()
-                # application/json表示消息主体是序列化后的json字符串
-                if ct.startswith('application/json'):
-                    params = await request.json()
-                    if not isinstance(params, dict):
-                        return web.HTTPBadRequest(text='JSON body must be object.')
-                    kw = params
-                # 消息主体是表单
-                elif ct.startswith('application/x-www-form-urlencoded') or ct.startswith('multipart/form-data'):
-                    params = await request.post()
-                    kw = dict(**params)
-                else:
-                    return web.HTTPBadRequest(text='Unsupported Content-Type: %s' % request.content_type)
-            # GET
-            if request.method == 'GET':
-                # query_string表示url中的查询字符串，即?后面的请求参数
-                # https://www.baidu.com/s?wd=python&ie=utf-8
-                # wd=python&ie=utf-8即为查询字符串
-                qs = request.query_string
-                if qs:
-                    kw = dict()
-                    # urllib.parse.parse_qs(qs, keep_blank_values=False, strict_parsing=False, encoding='utf-8', errors='replace')
-                    # 解析一个类型为application/x-www-form-urlencoded的查询字符串
-                    # 返回一个dict，k是查询变量名称，值是每个名称的值列表
-                    # 如{'wd': ['python'], 'ie', [utf-8]}
-                    for k, v in parse.parse_qs(qs, True).items():
-                        kw[k] = v[0]
-        if kw is None:
-            kw = dict(**request.match_info)
-        else:
-            if not self._has_var_kw_arg and self._named_kw_args:
-                # remove all unamed kw:
-                # 移除kw中不是fn关键字参数的项
-                copy = dict()
-                for name in self._named_kw_args:
-                    if name in kw:
-                        copy[name] = kw[name]
-                kw = copy
-            # check named arg:
-            # kw中加入match_info中的值
-            for k, v in request.match_info.items():
-                if k in kw:
-                    logging.warning('Duplicate arg name in named arg and kw args: %s' % k)
-                kw[k] = v
-        if self._has_request_arg:
-            kw['request'] = request
-        # check required kw:
-        # 检查kw是否包含全部没有默认值的关键字参数
-        if self._required_kw_args:
-            for name in self._required_kw_args:
-                if not name in kw:
-                    return web.HTTPBadRequest(text='Missing argument: %s' % name)
-        logging.info('call with args: %s' % str(kw))
+        params = None
+        if self._bind.wants_params:
+            params = await self._read_params(request)
+            if isinstance(params, web.StreamResponse):
+                return params
+        kw, missing = self._bind(request, params)
+        if missing is not None:
+            return web.HTTPBadRequest(text='Missing argument: %s' % missing)
+        logging.debug('call with args: %s', kw)
+        # 处理函数名，用于N+1查询等诊断信息
+        request.__handler__ = '%s.%s' % (self._func.__module__, self._func.__name__)
         # 调用handler，并返回response
         try:
             r = await self._func(**kw)
@@ -193,8 +256,56 @@ class RequestHandler(object):
             return dict(error=e.error, data=e.data, message=e.message)
 
 
+# build_static.py打包后的静态文件目录和manifest
+STATIC_DIST = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dist', 'static')
+STATIC_MANIFEST = os.path.join(STATIC_DIST, 'manifest.json')
+
+# 原文件名 => 带哈希的文件名，未打包时为空
+_static_manifest = dict()
+
+
+# jinja2中的static()函数，返回静态文件的URL，打包后为带哈希的文件名
+# 如{{ static('js/vue.min.js') }} => /static/js/vue.min.1a2b3c4d.js
+def static_url(path):
+    return '/static/' + _static_manifest.get(path, path)
+
+
+# 打包后的静态文件处理
+# 带哈希的文件长期缓存，客户端接受gzip且存在.gz预压缩文件时返回.gz，FileResponse使用sendfile发送
+class StaticHandler(object):
+    """docstring for StaticHandler"""
+
+    def __init__(self, root, manifest):
+        self._root = root
+        self._fingerprinted = frozenset(manifest.values())
+
+    async def __call__(self, request):
+        filename = request.match_info['filename']
+        path = os.path.normpath(os.path.join(self._root, filename))
+        if not path.startswith(self._root + os.sep) or not os.path.isfile(path):
+            raise web.HTTPNotFound()
+        headers = dict()
+        if filename in self._fingerprinted:
+            headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        if os.path.isfile(path + '.gz'):
+            headers['Vary'] = 'Accept-Encoding'
+            if 'gzip' in request.headers.get('Accept-Encoding', '').lower():
+                headers['Content-Type'] = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+                headers['Content-Encoding'] = 'gzip'
+                return web.FileResponse(path + '.gz', headers=headers)
+        return web.FileResponse(path, headers=headers)
+
+
 # 添加静态文件夹路径
+# 运行过build_static.py时使用打包后的目录，否则直接使用static目录
 def add_static(app):
+    global _static_manifest
+    if os.path.isfile(STATIC_MANIFEST):
+        with open(STATIC_MANIFEST) as f:
+            _static_manifest = json.load(f)
+        app.router.add_route('GET', '/static/{filename:.+}', StaticHandler(STATIC_DIST, _static_manifest))
+        logging.info('add static %s => %s (%s files in manifest)' % ('/static/', STATIC_DIST, len(_static_manifest)))
+        return
     # 提取同目录下的static目录
     path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
     # 将该目录加入应用的路由管理器中
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+RequestHandler参数绑定的微基准测试
+对比旧的逐请求处理方式和add_route时生成的参数绑定函数
+$ python3 coroweb_bench.py
+"""
+
+import timeit
+import logging
+from urllib import parse
+from coroweb import make_binder, parse_query, has_request_arg, has_var_kw_arg, has_named_kw_args, get_named_kw_args, get_required_kw_args
+
+__author__ = 'Will Wei'
+
+
+class FakeRequest(object):
+    """docstring for FakeRequest"""
+    def __init__(self, query_string='', match_info=None):
+        self.method = 'GET'
+        self.query_string = query_string
+        self.match_info = match_info or {}
+
+
+async def api_blogs(*, page='1', cursor=None):
+    pass
+
+
+async def api_create_comments(id, request, *, content):
+    pass
+
+
+# 旧的RequestHandler.__call__参数处理(不含await)，每个请求都检查签名信息并以INFO输出参数
+def legacy_bind(fn):
+    has_request = has_request_arg(fn)
+    has_var_kw = has_var_kw_arg(fn)
+    has_named = has_named_kw_args(fn)
+    named_kw_args = get_named_kw_args(fn)
+    required_kw_args = get_required_kw_args(fn)
+
+    def bind(request):
+        kw = None
+        if has_var_kw or has_named or required_kw_args:
+            qs = request.query_string
+            if qs:
+                kw = dict()
+                for k, v in parse.parse_qs(qs, True).items():
+                    kw[k] = v[0]
+        if kw is None:
+            kw = dict(**request.match_info)
+        else:
+            if not has_var_kw and named_kw_args:
+                copy = dict()
+                for name in named_kw_args:
+                    if name in kw:
+                        copy[name] = kw[name]
+                kw = copy
+            for k, v in request.match_info.items():
+                if k in kw:
+                    logging.warning('Duplicate arg name in named arg and kw args: %s' % k)
+                kw[k] = v
+        if has_request:
+            kw['request'] = request
+        if required_kw_args:
+            for name in required_kw_args:
+                if not name in kw:
+                    return None
+        logging.info('call with args: %s' % str(kw))
+        return kw
+    return bind
+
+
+# 新的参数绑定函数，加上RequestHandler.__call__中的查询字符串解析
+def compiled_bind(fn):
+    binder = make_binder(fn)
+
+    def bind(request):
+        params = None
+        if binder.wants_params and request.query_string:
+            params = parse_query(request.query_string)
+        kw, missing = binder(request, params)
+        logging.debug('call with args: %s', kw)
+        return kw
+    return bind
+
+
+def bench(name, fn, request, number=200000):
+    for label, make in (('before', legacy_bind), ('after', compiled_bind)):
+        bind = make(fn)
+        t = timeit.timeit(lambda: bind(request), number=number)
+        print('%-24s %-6s %8.3f us/call' % (name, label, t / number * 1e6))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    bench('api_blogs', api_blogs, FakeRequest('page=2'))
+    bench('api_blogs (no query)', api_blogs, FakeRequest())
+    bench('api_create_comments', api_create_comments, FakeRequest('content=hello', {'id': '001'}))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+coroweb.py 中条件GET的测试，不需要启动服务器
+运行: python3 coroweb_unit_test.py 或 pytest coroweb_unit_test.py
+"""
+
+from coroweb import make_etag, etag_matches, check_etag
+
+__author__ = 'Will Wei'
+
+
+class FakeRequest(object):
+    """docstring for FakeRequest"""
+    def __init__(self, if_none_match=None, path='/api/blogs', query_string=''):
+        self.headers = {}
+        if if_none_match is not None:
+            self.headers['If-None-Match'] = if_none_match
+        self.path = path
+        self.query_string = query_string
+
+
+ETAG = make_etag('/api/blogs', '', 1)
+
+
+def test_make_etag():
+    assert ETAG.startswith('"') and ETAG.endswith('"')
+    assert ETAG == make_etag('/api/blogs', '', 1)
+    assert ETAG != make_etag('/api/blogs', '', 2)
+    assert ETAG != make_etag('/api/blogs', 'page=2', 1)
+
+
+def test_no_if_none_match():
+    assert not etag_matches(FakeRequest(), ETAG)
+    assert not etag_matches(FakeRequest(''), ETAG)
+
+
+def test_strong_and_weak():
+    assert etag_matches(FakeRequest(ETAG), ETAG)
+    assert etag_matches(FakeRequest('W/' + ETAG), ETAG)
+    assert etag_matches(FakeRequest('"other", ' + ETAG), ETAG)
+    assert etag_matches(FakeRequest('*'), ETAG)
+    assert not etag_matches(FakeRequest('"other"'), ETAG)
+
+
+def test_compressed_suffix():
+    tag = ETAG[:-1]
+    assert etag_matches(FakeRequest(tag + '-gzip"'), ETAG)
+    assert etag_matches(FakeRequest(tag + '-br"'), ETAG)
+    assert etag_matches(FakeRequest('W/' + tag + '-gzip"'), ETAG)
+    assert etag_matches(FakeRequest('"other", W/' + tag + '-br"'), ETAG)
+    # 只去掉已知的编码后缀
+    assert not etag_matches(FakeRequest(tag + '-deflate"'), ETAG)
+    assert not etag_matches(FakeRequest(tag + '"-gzip'), ETAG)
+
+
+def test_check_etag():
+    request = FakeRequest(ETAG[:-1] + '-gzip"')
+    assert check_etag(request, 1)
+    assert request.__etag__ == ETAG
+    request = FakeRequest(ETAG)
+    assert not check_etag(request, 2)
+    assert request.__etag__ == make_etag('/api/blogs', '', 2)
+
+
+if __name__ == '__main__':
+    for name, fn in sorted(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print('%s ==> ok' % name)
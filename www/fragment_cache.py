@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Jinja2 fragment cache
+"""
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from cache import LRUCache
+from config import configs
+from versions import content_version
+
+__author__ = 'Will Wei'
+
+
+# 渲染后的模板片段，key为{% cache %}的key，值为(渲染前的内容版本, 片段)
+# 其他worker经过orm写入后版本改变，片段作废；invalidate_fragments只清除本进程的缓存
+cache = LRUCache(configs.fragment_cache.size, configs.fragment_cache.ttl)
+
+
+# 清除模板片段缓存，name为key中第一个':'之前的部分，或完整的key
+# 如invalidate_fragments('blogs')清除'blogs:1'、'blogs:2'等
+def invalidate_fragments(*names):
+    names = set(names)
+    cache.remove_if(lambda key, value: key in names or key.split(':', 1)[0] in names)
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Cache a rendered block of template:
+
+        {% cache 'blogs:' ~ page.page_index, 60 %}
+            ...
+        {% endcache %}
+
+    The ttl (seconds) is optional and defaults to configs.fragment_cache.ttl.
+    """
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', args), [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, key, ttl, caller):
+        version = content_version()
+        cached = cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        rv = caller()
+        cache.set(key, (version, rv), ttl)
+        return rv
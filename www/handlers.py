@@ -9,14 +9,19 @@ import asyncio
 import time
 import hashlib
 import re
-import json
 import logging
-import markdown2
+import markdown_cache
+import orm
+import serializer
+import metrics
 from aiohttp import web
-from coroweb import get, post
+from coroweb import get, post, check_etag
 from models import User, Comment, Blog, next_id
-from apis import Page, APIError, APIValueError, APIResourceNotFoundError, APIPermissionError
+from apis import Page, CursorPage, decode_cursor, APIError, APIValueError, APIResourceNotFoundError, APIPermissionError
 from config import configs
+from cache import LRUCache, PageCache
+from fragment_cache import invalidate_fragments
+from versions import versions
 
 __author__ = 'Will Wei'
 
@@ -49,16 +54,72 @@ def get_page_index(page_str):
     return p
 
 
+# 键集分页查询，cursor为空字符串时返回第一页，不需要count查询
+async def get_cursor_page(model, cursor, where=None, args=None, page_size=10, **kw):
+    after, before = decode_cursor(cursor)
+    items, has_more = await model.findSeek(where, args, after=after, before=before, limit=page_size, **kw)
+    page = CursorPage(items, page_size, has_more, backward=before is not None, cursor=cursor or None)
+    return page, items
+
+
+# markdown转html，日志保存时调用，结果存入html_content
+def blog2html(content):
+    return markdown_cache.markdown(content)
+
+
 # 文本转html
 def text2html(text):
     lines = map(lambda s: '<p>%s</p>' % s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'), filter(lambda s: s.strip() != '', text.split('\n')))
     return ''.join(lines)
 
 
+# 匿名访问的整页缓存，由app.page_cache_factory读写，写操作的处理函数调用invalidate清除受影响的页面
+page_cache = PageCache(configs.page_cache.size, configs.page_cache.ttl)
+
+
+# 记录变化后更新共享的表版本，所有worker据此判断ETag和缓存是否过期
+def _bump_version(action, models):
+    versions.bump(models[0].__table__)
+
+
+for _table in versions.names:
+    orm.add_listener(_table, _bump_version)
+
+
+# 日志写入后清除相关页面和模板片段
+# 由orm通知，unit_of_work在处理函数返回后才写入，不能在处理函数中清除
+def _on_blog_change(action, blogs):
+    paths = ['/', '/api/blogs']
+    for blog in blogs:
+        paths.extend(['/blog/%s' % blog.id, '/api/blogs/%s' % blog.id])
+    page_cache.invalidate(*paths)
+    if action == 'delete':
+        invalidate_fragments('blogs', *['comments:%s' % blog.id for blog in blogs])
+    else:
+        invalidate_fragments('blogs')
+
+
+orm.add_listener(Blog.__table__, _on_blog_change)
+
 """
 Cookie
 """
 
+# 已验证的cookie => (users表版本, 用户)，避免每个请求都查询users表和计算SHA1
+# 其他worker经过orm修改用户后版本改变，缓存作废
+_user_cache = LRUCache(configs.auth_cache.size, configs.auth_cache.ttl)
+
+
+# 用户记录更新或删除时清除这些用户的所有缓存，新用户没有缓存
+def _on_user_change(action, users):
+    if action == 'insert':
+        return
+    ids = set(user.id for user in users)
+    _user_cache.remove_if(lambda cookie, cached: cached[1].id in ids)
+
+
+orm.add_listener(User.__table__, _on_user_change)
+
 
 # 通过用户信息计算cookie
 def user2cookie(user, max_age):
@@ -88,6 +149,10 @@ async def cookie2user(cookie_str):
         uid, expires, sha1 = L
         if int(expires) < time.time():
             return None
+        version = versions.get('users')
+        cached = _user_cache.get(cookie_str)
+        if cached is not None and cached[0] == version:
+            return User(**cached[1])
         user = await User.find(uid)
         if user is None:
             return None
@@ -96,8 +161,12 @@ async def cookie2user(cookie_str):
         if sha1 != hashlib.sha1(s.encode('utf-8')).hexdigest():
             logging.info('invalid sha1')
             return None
+        # 在副本上隐藏口令，不修改会话中的对象
+        user = User(**user)
         user.password = '******'
-        return user
+        # 缓存时间不超过cookie的过期时间
+        _user_cache.set(cookie_str, (version, user), min(configs.auth_cache.ttl, int(expires) - time.time()))
+        return User(**user)
     except Exception as e:
         logging.exception(e)
         return None
@@ -110,18 +179,29 @@ async def cookie2user(cookie_str):
 
 # 首页
 @get('/')
-async def index(request, *, page='1'):
+async def index(request, *, page='1', cursor=None):
+    # 带cursor参数时使用键集分页
+    if cursor is not None:
+        page, blogs = await get_cursor_page(Blog, cursor, exclude=['content', 'html_content'])
+        return {
+            '__template__': 'blogs.html',
+            'page': page,
+            'blogs': blogs,
+            'fragment_key': 'blogs:cursor:%s' % cursor,
+            '__user__': request.__user__
+        }
     page_index = get_page_index(page)
-    num = await Blog.findNumber('count(id)')
+    num = await Blog.findNumber('count(id)', approximate=configs.orm.approximate_count)
     page = Page(num, page_index)
     if page == 0:
         blogs = []
     else:
-        blogs = await Blog.findAll(orderBy='created_at desc', limit=(page.offset, page.limit))
+        blogs = await Blog.findAll(orderBy='created_at desc', limit=(page.offset, page.limit), exclude=['content', 'html_content'])
     return{
         '__template__': 'blogs.html',
         'page': page,
         'blogs': blogs,
+        'fragment_key': 'blogs:page:%s' % page.page_index,
         '__user__': request.__user__
     }
 
@@ -149,7 +229,9 @@ async def get_blog(request, *, id):
     comments = await Comment.findAll('blog_id=?', [id], orderBy='created_at desc')
     for c in comments:
         c.html_content = text2html(c.content)
-    blog.html_content = markdown2.markdown(blog.content)
+    # 未回填的旧日志在读取时渲染
+    if blog.html_content is None:
+        blog.html_content = blog2html(blog.content)
     return {
         '__template__': 'blog.html',
         'blog': blog,
@@ -223,15 +305,20 @@ Api
 
 # 获取用户信息
 @get('/api/users')
-async def api_get_users(*, page='1'):
+async def api_get_users(request, *, page='1', cursor=None):
+    # 用users表的共享版本作为ETag的版本，不需要查询
+    if check_etag(request, versions.get('users')):
+        return web.HTTPNotModified()
+    if cursor is not None:
+        p, users = await get_cursor_page(User, cursor, exclude=['password'])
+        return dict(page=p, users=users)
     page_index = get_page_index(page)
-    num = await User.findNumber('count(id)')
+    num = await User.findNumber('count(id)', approximate=configs.orm.approximate_count)
     p = Page(num, page_index)
     if num == 0:
         return dict(page=p, users=())
-    users = await User.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
-    for u in users:
-        u.passwd = '******'
+    # 不查询口令，响应中不包含password
+    users = await User.findAll(orderBy='created_at desc', limit=(p.offset, p.limit), exclude=['password'])
     return dict(page=p, users=users)
 
 
@@ -256,12 +343,14 @@ async def api_register_user(*, email, name, passwd):
     image = 'http://www.gravatar.com/avatar/%s?d=mm&s=120' % hashlib.md5(email.encode('utf-8')).hexdigest()
     user = User(id=uid, name=name.strip(), email=email, password=encrypt_password, image=image)
     await user.save()
+    page_cache.invalidate('/api/users')
     # make session cookie
     r = web.Response()
     r.set_cookie(COOKIE_NAME, user2cookie(user, 86400), max_age=86400, httponly=True)
+    user = User(**user)
     user.password = '******'
     r.content_type = 'application/json'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+    r.body = serializer.dumps(user)
     return r
 
 
@@ -286,9 +375,10 @@ async def authenticate(*, email, passwd):
     # authenticate ok, set cookie:
     r = web.Response()
     r.set_cookie(COOKIE_NAME, user2cookie(user, 86400), max_age=86400, httponly=True)
+    user = User(**user)
     user.password = '******'
     r.content_type = 'application/json'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+    r.body = serializer.dumps(user)
     return r
 
 
@@ -322,6 +412,7 @@ async def api_create_blog(request, *, name, summary, content):
         name=name.strip(),
         summary=summary.strip(),
         content=content.strip())
+    blog.html_content = blog2html(blog.content)
     await blog.save()
     return blog
 
@@ -335,18 +426,22 @@ async def api_get_blog(*, id):
 
 # 获取页日志
 @get('/api/blogs')
-async def api_blogs(*, page='1'):
+async def api_blogs(*, page='1', cursor=None):
+    if cursor is not None:
+        p, blogs = await get_cursor_page(Blog, cursor, exclude=['content', 'html_content'])
+        return dict(page=p, blogs=blogs)
     page_index = get_page_index(page)
-    num = await Blog.findNumber('count(id)')
+    num = await Blog.findNumber('count(id)', approximate=configs.orm.approximate_count)
     p = Page(num, page_index)
     if num == 0:
         return dict(page=p, blogs=())
-    blogs = await Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
+    blogs = await Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit), exclude=['content', 'html_content'])
     return dict(page=p, blogs=blogs)
 
 
 # 更新日志
 @post('/api/blogs/{id}')
+@orm.unit_of_work
 async def api_update_blog(id,request,*,name,summary,content):
     check_admin(request)
     blog = await Blog.find(id)
@@ -359,7 +454,8 @@ async def api_update_blog(id,request,*,name,summary,content):
     blog.name = name.strip()
     blog.summary = summary.strip()
     blog.content = content.strip()
-    await blog.update()
+    blog.html_content = blog2html(blog.content)
+    # 处理函数返回后由unit_of_work在一个事务中写入修改过的字段
     return blog
 
 
@@ -374,9 +470,14 @@ async def api_delete_blog(request, *, id):
 
 # 获取页评论
 @get('/api/comments')
-async def api_comments(*, page='1'):
+async def api_comments(request, *, page='1', cursor=None):
+    if check_etag(request, versions.get('comments')):
+        return web.HTTPNotModified()
+    if cursor is not None:
+        p, comments = await get_cursor_page(Comment, cursor)
+        return dict(page=p, comments=comments)
     page_index = get_page_index(page)
-    num = await Comment.findNumber('count(id)')
+    num = await Comment.findNumber('count(id)', approximate=configs.orm.approximate_count)
     p = Page(num, page_index)
     if num == 0:
         return dict(page=p, comments=())
@@ -402,6 +503,8 @@ async def api_create_comments(id, request, *, content):
         user_image=user.image,
         content=content.strip())
     await comment.save()
+    page_cache.invalidate('/blog/%s' % blog.id, '/api/comments')
+    invalidate_fragments('comments:%s' % blog.id)
     return comment
 
 
@@ -413,4 +516,23 @@ async def api_delete_comments(id, request):
     if c is None:
         raise APIResourceNotFoundError('Comment')
     await c.remove()
+    page_cache.invalidate('/blog/%s' % c.blog_id, '/api/comments')
+    invalidate_fragments('comments:%s' % c.blog_id)
     return dict(id=id)
+
+
+# 本进程的指标，Prometheus文本格式
+def metrics_response():
+    return web.Response(body=metrics.exposition(), headers={
+        'Content-Type': 'text/plain; version=0.0.4; charset=utf-8',
+        'Cache-Control': 'no-store'
+    })
+
+
+# 指标包含SQL模板和内部耗时，公开的端口上只允许管理员访问
+# 抓取程序使用configs.metrics.port的单独监听
+@get('/metrics')
+def get_metrics(request):
+    if request.__user__ is None or not request.__user__.admin:
+        return web.HTTPForbidden()
+    return metrics_response()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Non-blocking logging
+"""
+
+import os
+import sys
+import queue
+import atexit
+import random
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+__author__ = 'Will Wei'
+
+
+# 访问日志，每行为key=value格式
+access_logger = logging.getLogger('access')
+
+_listener = None
+_pid = None
+
+
+# 配置日志：event loop中只把日志记录放入队列，由后台线程写到stderr
+# fork后的子进程需要重新调用，后台线程不会被fork
+def init_logging(level='INFO'):
+    global _listener, _pid
+    if _pid == os.getpid():
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s'))
+    q = queue.Queue(-1)
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+    root.addHandler(QueueHandler(q))
+    root.setLevel(level)
+    _listener = QueueListener(q, handler, respect_handler_level=True)
+    _listener.start()
+    _pid = os.getpid()
+    atexit.register(stop_logging)
+
+
+# 停止后台线程，写出队列中剩余的日志
+def stop_logging():
+    global _listener, _pid
+    if _listener is not None and _pid == os.getpid():
+        _listener.stop()
+        _listener = None
+        _pid = None
+
+
+# 记录一条访问日志
+# 按sample比例抽样，状态码>=500或耗时超过slow_ms的请求总是记录
+def access_log(request, status, elapsed, size=None, sample=1.0, slow_ms=None):
+    ms = elapsed * 1000
+    if status < 500 and (slow_ms is None or ms < slow_ms) and sample < 1.0 and random.random() >= sample:
+        return
+    user = getattr(request, '__user__', None)
+    # query_stats_factory记录的本请求SQL条数和耗时
+    stats = getattr(request, '__query_stats__', None)
+    access_logger.info('method=%s path=%s status=%s ms=%.1f bytes=%s user=%s queries=%s db_ms=%s', request.method, request.path, status, ms,
+                       size if size is not None else '-', user.id if user else '-',
+                       stats.count if stats else '-', '%.1f' % (stats.elapsed * 1000) if stats else '-')
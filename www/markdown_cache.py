@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+markdown2 with an in-memory cache
+"""
+
+import hashlib
+import markdown2
+from cache import LRUCache
+from config import configs
+
+__author__ = 'Will Wei'
+
+
+# 渲染结果缓存，按html的总字节数限制大小，hits/misses为命中统计
+cache = LRUCache(configs.markdown_cache.maxsize, maxbytes=configs.markdown_cache.maxbytes)
+
+
+# markdown2.markdown()的默认选项
+_DEFAULTS = dict(html4tags=False, tab_width=markdown2.DEFAULT_TAB_WIDTH, safe_mode=None,
+                 extras=None, link_patterns=None, use_file_vars=False)
+
+
+# 缓存key：文本和全部选项的SHA1，未指定的选项按默认值计算
+def _cache_key(text, kw):
+    kw = dict(_DEFAULTS, **kw)
+    extras = kw.get('extras')
+    if extras is not None and not isinstance(extras, dict):
+        extras = dict([(e, None) for e in extras])
+    options = sorted((k, repr(v)) for k, v in kw.items() if k != 'extras')
+    s = '%s\0%r\0%r' % (text, sorted((k, repr(v)) for k, v in (extras or {}).items()), options)
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+# 与markdown2.markdown()参数相同，相同的文本和选项只渲染一次
+def markdown(text, **kw):
+    key = _cache_key(text, kw)
+    html = cache.get(key)
+    if html is None:
+        html = markdown2.markdown(text, **kw)
+        cache.set(key, html)
+    return html
+
+
+# 对已创建的markdown2.Markdown对象使用缓存，选项取自该对象
+def convert(markdowner, text):
+    kw = dict(html4tags=markdowner.empty_element_suffix == '>', tab_width=markdowner.tab_width,
+              safe_mode=markdowner.safe_mode, extras=markdowner._instance_extras,
+              link_patterns=markdowner.link_patterns, use_file_vars=markdowner.use_file_vars)
+    key = _cache_key(text, kw)
+    html = cache.get(key)
+    if html is None:
+        html = markdowner.convert(text)
+        cache.set(key, html)
+    return html
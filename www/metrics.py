@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Metrics in Prometheus text exposition format
+"""
+
+import os
+import bisect
+from orm import statement_template, pool_stats
+
+__author__ = 'Will Wei'
+
+
+# 默认的耗时分桶(秒)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in pairs)
+
+
+class Metric(object):
+    """
+    Base of all metrics, the values are kept per label values tuple.
+    """
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = dict()
+        registry.append(self)
+
+    # const: 所有序列都加上的标签，[(名称, 值)]
+    def expose(self, const=()):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.type)]
+        for labels, value in sorted(self._values.items()):
+            lines.append('%s%s %s' % (self.name, _labels(self.labelnames, labels, const), value))
+        return lines
+
+
+class Counter(Metric):
+    """docstring for Counter"""
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """docstring for Gauge"""
+    type = 'gauge'
+
+    def set(self, value, labels=()):
+        self._values[labels] = value
+
+    def inc(self, labels=(), amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    """docstring for Histogram"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        item = self._values.get(labels)
+        if item is None:
+            # [各分桶计数, 总和, 总数]
+            item = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            item[0][i] += 1
+        item[1] += value
+        item[2] += 1
+
+    def expose(self, const=()):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.type)]
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            acc = 0
+            for bound, n in zip(self.buckets, counts):
+                acc += n
+                lines.append('%s_bucket%s %s' % (self.name, _labels(self.labelnames, labels, list(const) + [('le', bound)]), acc))
+            lines.append('%s_bucket%s %s' % (self.name, _labels(self.labelnames, labels, list(const) + [('le', '+Inf')]), count))
+            lines.append('%s_sum%s %s' % (self.name, _labels(self.labelnames, labels, const), total))
+            lines.append('%s_count%s %s' % (self.name, _labels(self.labelnames, labels, const), count))
+        return lines
+
+
+# 所有已创建的指标
+registry = []
+
+# 输出前调用的函数，用于采集连接池等当前状态
+collectors = []
+
+
+# 当前worker的序号，由prefork.Supervisor设置，单进程时为0
+# 指标是每个进程的，所有序列带worker标签，不同worker的数据不会混在同一序列中
+def worker_label():
+    return os.environ.get('WORKER_INDEX', '0')
+
+
+# 输出全部指标的文本格式
+def exposition():
+    for fn in collectors:
+        fn()
+    const = [('worker', worker_label())]
+    lines = []
+    for metric in registry:
+        lines.extend(metric.expose(const))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+http_requests = Counter('http_requests_total', 'HTTP requests by route, method and status.', ('route', 'method', 'status'))
+http_request_duration = Histogram('http_request_duration_seconds', 'HTTP request latency by route and method.', ('route', 'method'))
+http_requests_in_flight = Gauge('http_requests_in_flight', 'HTTP requests being processed.')
+sql_duration = Histogram('sql_query_duration_seconds', 'SQL statement latency by statement template.', ('statement',))
+sql_rows = Counter('sql_query_rows_total', 'Rows returned or affected by statement template.', ('statement',))
+db_pool_size = Gauge('db_pool_size', 'Connections in the orm pool.')
+db_pool_free = Gauge('db_pool_free', 'Free connections in the orm pool.')
+db_pool_maxsize = Gauge('db_pool_maxsize', 'Max connections of the orm pool.')
+db_pool_waiters = Gauge('db_pool_waiters', 'Coroutines waiting for a pool connection.')
+
+
+# orm.add_query_hook的回调，记录SQL耗时和行数
+def observe_query(sql, args, elapsed, rows):
+    statement = statement_template(sql)
+    sql_duration.observe(elapsed, (statement,))
+    if rows:
+        sql_rows.inc((statement,), rows)
+
+
+# metrics.collectors中的函数，采集orm连接池状态
+def collect_pool_stats():
+    stats = pool_stats()
+    if stats is None:
+        return
+    db_pool_size.set(stats['size'])
+    db_pool_free.set(stats['free'])
+    db_pool_maxsize.set(stats['maxsize'])
+    db_pool_waiters.set(stats['waiters'])
+
+
+# 请求的路由模板，如/blog/{id}，未匹配路由的请求为unmatched
+def route_name(request):
+    route = getattr(request.match_info, 'route', None)
+    resource = getattr(route, 'resource', None)
+    if resource is None:
+        return 'unmatched'
+    info = resource.get_info()
+    return info.get('formatter') or info.get('path') or info.get('prefix') or 'unknown'
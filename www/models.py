@@ -40,6 +40,8 @@ class Blog(Model):
     name = StringField(ddl='varchar(50)')
     summary = StringField(ddl='varchar(200)')
     content = TextField()
+    # content渲染后的html，保存日志时生成
+    html_content = TextField()
     created_at = FloatField(default=time.time)
 
 
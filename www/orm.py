@@ -7,14 +7,205 @@ ORM
 
 import asyncio
 import aiomysql
+import functools
 import logging
+import re
+import time
+import weakref
+from cache import LRUCache
 
 __author__ = 'Will Wei'
 
 
-# SQL日志输出
+class _TaskVar(object):
+    """
+    ContextVar substitute for Python 3.6: the value belongs to the current asyncio task.
+    Unlike ContextVar, tasks created inside do not inherit the value.
+    """
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+        self._values = weakref.WeakKeyDictionary()
+
+    # Python 3.6只有asyncio.Task.current_task
+    _current_task = staticmethod(getattr(asyncio, 'current_task', None) or asyncio.Task.current_task)
+
+    def _task(self):
+        try:
+            task = self._current_task()
+        except RuntimeError:
+            task = None
+        if task is None:
+            raise RuntimeError('%s can only be used in a task.' % self.name)
+        return task
+
+    def get(self):
+        try:
+            return self._values.get(self._task(), self.default)
+        except RuntimeError:
+            return self.default
+
+    def set(self, value):
+        task = self._task()
+        token = (task, self._values.get(task, self.default))
+        self._values[task] = value
+        return token
+
+    def reset(self, token):
+        task, value = token
+        self._values[task] = value
+
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = _TaskVar
+
+
+# ORM运行参数，可通过configure()用configs.orm覆盖
+# count_cache_ttl: count查询结果的缓存秒数，0表示不缓存
+# count_cache_size: 缓存的count查询结果数
+# slow_query_ms: 超过此毫秒数的语句记录到慢查询日志，0表示不记录
+# n_plus_one_threshold: 一个请求中同一语句模板以不同参数执行超过此次数时报告N+1查询，0表示不检测
+# n_plus_one_strict: 检测到N+1查询时抛出NPlusOneError
+settings = dict(count_cache_ttl=60, count_cache_size=1024, slow_query_ms=100, n_plus_one_threshold=0, n_plus_one_strict=False)
+
+
+class NPlusOneError(Exception):
+    """docstring for NPlusOneError"""
+    pass
+
+
+def configure(**kw):
+    settings.update(kw)
+    _count_cache.maxsize = settings['count_cache_size']
+
+
+# SQL日志输出，DEBUG级别，未开启时不格式化
 def log(sql, args=()):
-    logging.info('SQL: %s' % sql)
+    logging.debug('SQL: %s', sql)
+
+
+_RE_IN_LIST = re.compile(r'in \((\?, )*\?\)')
+_RE_VALUES = re.compile(r'values \((\?, )*\?\)(, \((\?, )*\?\))*')
+_RE_SPACES = re.compile(r'\s+')
+
+
+# SQL语句模板：合并空白，IN (?, ?, ...)合并为IN (...)，多行insert的VALUES (?, ?), (?, ?), ...合并为VALUES (...)
+# 使不同参数个数的语句归为一类，用作指标标签时数量有限
+def statement_template(sql):
+    sql = _RE_SPACES.sub(' ', sql.strip())
+    return _RE_VALUES.sub('values (...)', _RE_IN_LIST.sub('in (...)', sql))
+
+
+# 参数的类型，不输出参数值，参数很多时只输出前几个
+def args_shape(args, limit=8):
+    args = tuple(args or ())
+    names = [type(arg).__name__ for arg in args[:limit]]
+    if len(args) > limit:
+        names.append('... %s args' % len(args))
+    return '(%s)' % ', '.join(names)
+
+
+class QueryStats(object):
+    """
+    Statements run while handling one request: count and total seconds.
+    When N+1 detection is on, the distinct args of each statement template are kept too.
+    """
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+        self.handler = None
+        self.templates = dict()
+
+    def add(self, sql, args, elapsed, rows):
+        self.count += 1
+        self.elapsed += elapsed
+        if settings['n_plus_one_threshold']:
+            # 模板 => [执行次数, 不同参数的集合]
+            item = self.templates.setdefault(statement_template(sql), [0, set()])
+            item[0] += 1
+            item[1].add(repr(tuple(args or ())))
+
+    # 以不同参数执行超过n_plus_one_threshold次的语句模板，返回[(模板, 执行次数)]
+    def repeated(self):
+        threshold = settings['n_plus_one_threshold']
+        if not threshold:
+            return []
+        return [(template, count) for template, (count, distinct) in self.templates.items() if len(distinct) > threshold]
+
+    def __str__(self):
+        return 'queries: %s, db ms: %.1f' % (self.count, self.elapsed * 1000)
+
+    __repr__ = __str__
+
+
+_query_stats = ContextVar('query_stats', default=None)
+
+
+# 开始统计当前请求的SQL，返回(stats, token)，请求结束时调用end_query_stats(token)
+def begin_query_stats():
+    stats = QueryStats()
+    return stats, _query_stats.set(stats)
+
+
+def end_query_stats(token):
+    _query_stats.reset(token)
+
+
+# 当前请求的QueryStats，不在请求中时为None
+def current_query_stats():
+    return _query_stats.get()
+
+
+# 检查N+1查询：记录警告，strict模式下抛出NPlusOneError
+def check_n_plus_one(stats):
+    if stats is None:
+        return []
+    repeated = stats.repeated()
+    for template, count in repeated:
+        logging.warning('N+1 query in %s: executed %s times with different args, SQL: %s', stats.handler or '-', count, template)
+    if repeated and settings['n_plus_one_strict']:
+        raise NPlusOneError('N+1 query in %s: %s' % (stats.handler or '-', '; '.join(t for t, c in repeated)))
+    return repeated
+
+
+# 内置的回调：累加到当前请求的统计，记录慢查询
+def _track_query(sql, args, elapsed, rows):
+    stats = current_query_stats()
+    if stats is not None:
+        stats.add(sql, args, elapsed, rows)
+    slow_ms = settings['slow_query_ms']
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        logging.warning('slow query: %.1f ms, rows: %s, SQL: %s, args: %s', elapsed * 1000, rows, statement_template(sql), args_shape(args))
+
+
+# 语句执行后的回调：fn(sql, args, elapsed, rows)，elapsed为秒数，rows为返回或影响的行数
+# 用于统计指标、慢查询日志等
+_query_hooks = [_track_query]
+
+
+def add_query_hook(fn):
+    _query_hooks.append(fn)
+
+
+def run_query_hooks(sql, args, elapsed, rows):
+    for fn in _query_hooks:
+        try:
+            fn(sql, args, elapsed, rows)
+        except Exception as e:
+            logging.exception(e)
+
+
+# 连接池状态：连接数、空闲连接数、最大连接数、等待连接的协程数
+def pool_stats():
+    global __pool
+    try:
+        pool = __pool
+    except NameError:
+        return None
+    waiters = getattr(getattr(pool, '_cond', None), '_waiters', None) or ()
+    return dict(size=pool.size, free=pool.freesize, maxsize=pool.maxsize, waiters=len(waiters))
 
 
 # 创建全局连接池
@@ -49,15 +240,111 @@ async def select(sql, args, size=None):
     global __pool
     async with __pool.get() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cur:
+            start = time.time()
             await cur.execute(sql.replace('?', '%s'), args or ())
             if size:
                 rs = await cur.fetchmany(size)
             else:
                 rs = await cur.fetchall()
-        logging.info('rows returned: %s' % len(rs))
+            run_query_hooks(sql, args, time.time() - start, len(rs))
+        logging.debug('rows returned: %s', len(rs))
         return rs
 
 
+def _get_pool():
+    return __pool
+
+
+class SelectStream(object):
+    """
+    Streaming SELECT with a server-side cursor (SSDictCursor), rows are read batch by batch.
+    The connection is held until the rows are exhausted or aclose() is called:
+
+        async with select_iter(sql, args) as rows:
+            async for row in rows:
+                ...
+
+    Closing before the end closes the connection instead of draining the remaining rows.
+    wrap(row) converts each row, e.g. to a Model.
+    """
+    def __init__(self, sql, args, batch=500, wrap=None):
+        self.sql = sql
+        self.args = args
+        self.batch = batch
+        self.wrap = wrap
+        self._conn = None
+        self._cur = None
+        self._rows = []
+        self._done = False
+        # 只统计执行语句和读取数据的时间，不包括调用方处理每行的时间
+        self._elapsed = 0.0
+        self._count = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._rows:
+            if self._done:
+                raise StopAsyncIteration
+            try:
+                await self._fetch()
+            except BaseException:
+                await self.aclose()
+                raise
+            if not self._rows:
+                await self._finish()
+                raise StopAsyncIteration
+        row = self._rows.pop()
+        return self.wrap(row) if self.wrap is not None else row
+
+    async def _fetch(self):
+        start = time.time()
+        if self._conn is None:
+            log(self.sql, self.args)
+            self._conn = await _get_pool().acquire()
+            self._cur = await self._conn.cursor(aiomysql.SSDictCursor)
+            await self._cur.execute(self.sql.replace('?', '%s'), self.args or ())
+        # 倒序保存，从末尾取出
+        self._rows = list(reversed(await self._cur.fetchmany(self.batch)))
+        self._count += len(self._rows)
+        self._elapsed += time.time() - start
+
+    # 读完全部行，正常关闭游标，归还连接
+    async def _finish(self):
+        conn, cur = self._conn, self._cur
+        self._conn, self._cur, self._done = None, None, True
+        try:
+            await cur.close()
+        finally:
+            await _get_pool().release(conn)
+            run_query_hooks(self.sql, self.args, self._elapsed, self._count)
+
+    # 提前结束：关闭连接，不读取服务端剩余的行，连接池丢弃已关闭的连接
+    async def aclose(self):
+        if self._done:
+            return
+        self._done = True
+        self._rows = []
+        conn, self._conn, self._cur = self._conn, None, None
+        if conn is not None:
+            conn.close()
+            await _get_pool().release(conn)
+            run_query_hooks(self.sql, self.args, self._elapsed, self._count)
+
+
+# 流式SELECT，返回SelectStream，内存占用与batch成正比
+# 中途退出循环时需要用async with或调用aclose()释放连接
+def select_iter(sql, args, batch=500, wrap=None):
+    return SelectStream(sql, args, batch, wrap)
+
+
 # INSERT、UPDATE、DELETE语句
 # 3种SQL执行所需参数一样，定义通用执行函数
 async def execute(sql, args, autocommit=True):
@@ -67,8 +354,10 @@ async def execute(sql, args, autocommit=True):
             await conn.begin()
         try:
             async with conn.cursor(aiomysql.DictCursor) as cur:
+                start = time.time()
                 await cur.execute(sql.replace('?', '%s'), args)
                 affected = cur.rowcount
+                run_query_hooks(sql, args, time.time() - start, affected)
             if not autocommit:
                 await conn.commit()
         except BaseException as e:
@@ -78,6 +367,199 @@ async def execute(sql, args, autocommit=True):
         return affected
 
 
+# 批量执行多条语句，共用一个连接并在同一个事务中提交
+# statements: [(sql, args), ...]
+async def execute_batch(statements):
+    async with __pool.get() as conn:
+        await conn.begin()
+        try:
+            affected = 0
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                for sql, args in statements:
+                    log(sql)
+                    start = time.time()
+                    await cur.execute(sql.replace('?', '%s'), args)
+                    affected += cur.rowcount
+                    run_query_hooks(sql, args, time.time() - start, cur.rowcount)
+            await conn.commit()
+        except BaseException as e:
+            await conn.rollback()
+            raise
+        return affected
+
+
+__max_allowed_packet = None
+
+
+# 获取服务器的max_allowed_packet，只查询一次
+async def get_max_allowed_packet():
+    global __max_allowed_packet
+    if __max_allowed_packet is None:
+        rs = await select('select @@max_allowed_packet _num_', None, 1)
+        __max_allowed_packet = int(rs[0]['_num_'])
+    return __max_allowed_packet
+
+
+# count查询缓存：(表名, 查询字段, where, 参数) => 结果，条数不超过count_cache_size
+# 表中有记录插入、更新、删除时清除该表的所有缓存
+_count_cache = LRUCache(settings['count_cache_size'])
+
+
+def get_cached_count(key):
+    return _count_cache.get(key)
+
+
+def set_cached_count(key, num):
+    ttl = settings['count_cache_ttl']
+    if ttl > 0:
+        _count_cache.set(key, num, ttl)
+
+
+def clear_count_cache(table=None):
+    if table is None:
+        _count_cache.clear()
+        return
+    _count_cache.remove_if(lambda key, num: key[0] == table)
+
+
+# 记录变化监听：{表名: [fn, ...]}
+# 保存、更新、删除记录后调用fn(action, models)，action为'insert'、'update'、'delete'
+# models为该表中变化的对象列表，批量写入时每个表只通知一次
+_listeners = dict()
+
+
+def add_listener(table, fn):
+    _listeners.setdefault(table, []).append(fn)
+
+
+def notify(action, *models):
+    tables = dict()
+    for model in models:
+        tables.setdefault(model.__table__, []).append(model)
+    for table, changed in tables.items():
+        for fn in _listeners.get(table, ()):
+            try:
+                fn(action, changed)
+            except Exception as e:
+                logging.exception(e)
+
+
+_session = ContextVar('session', default=None)
+
+
+class Session(object):
+    """
+    Request-scoped identity map and unit of work.
+    Rows loaded while a session is active are kept by (table, primary key),
+    so loading the same row again in the request returns the same object.
+    Inside unit_of_work, changing a mapped field of such an object marks it dirty,
+    flush() updates all dirty objects in one transaction.
+    """
+    def __init__(self):
+        self.identity = dict()
+        self.dirty = dict()
+        # 进行中的unit_of_work数，为0时不记录待写入的对象
+        self.units = 0
+
+    @staticmethod
+    def key(model):
+        return (model.__table__, str(model.getValue(model.__primaty_key__)))
+
+    def get(self, cls, pk):
+        return self.identity.get((cls.__table__, str(pk)))
+
+    # 加入身份映射，已存在时把新加载的字段合并到已有对象(不覆盖已修改的字段)，返回已有对象
+    def add(self, model):
+        key = self.key(model)
+        existing = self.identity.get(key)
+        if existing is None:
+            self.identity[key] = model
+            return model
+        loaded = [f for f in existing._deferred if f not in model._deferred]
+        if loaded:
+            for f in loaded:
+                existing[f] = model[f]
+            object.__setattr__(existing, '_deferred', tuple(f for f in existing._deferred if f not in loaded))
+        return existing
+
+    def contains(self, model):
+        return self.identity.get(self.key(model)) is model
+
+    def mark_dirty(self, model):
+        if self.units and self.contains(model):
+            self.dirty[self.key(model)] = model
+
+    # 对象已写入或删除，不再需要flush，evict为True时同时移出身份映射
+    def discard(self, model, evict=False):
+        key = self.key(model)
+        self.dirty.pop(key, None)
+        if evict and self.identity.get(key) is model:
+            del self.identity[key]
+
+    # 在一个事务中更新所有修改过的对象，返回影响的行数
+    async def flush(self):
+        if not self.dirty:
+            return 0
+        models = [m for m in self.dirty.values() if m._dirty]
+        self.dirty.clear()
+        if not models:
+            return 0
+        rows = await execute_batch([m._updateStatement() for m in models])
+        for m in models:
+            m._markClean()
+        for table in set(m.__table__ for m in models):
+            clear_count_cache(table)
+        notify('update', *models)
+        return rows
+
+
+# 开始一个会话，返回(session, token)，结束时调用end_session(token)
+def begin_session():
+    session = Session()
+    return session, _session.set(session)
+
+
+def end_session(token):
+    if token is not None:
+        _session.reset(token)
+
+
+# 当前的Session，没有开始会话时为None
+def current_session():
+    return _session.get()
+
+
+# 装饰器，处理函数正常返回后在一个事务中写入修改过的对象，抛出异常时不写入
+# 没有会话时(未启用身份映射)为这个处理函数开始一个会话
+def unit_of_work(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kw):
+        session = current_session()
+        token = None
+        if session is None:
+            session, token = begin_session()
+        session.units += 1
+        try:
+            r = await fn(*args, **kw)
+            await session.flush()
+            return r
+        except BaseException:
+            session.dirty.clear()
+            raise
+        finally:
+            session.units -= 1
+            end_session(token)
+    return wrapper
+
+
+# findMany每条IN查询最多包含的主键数
+IN_CHUNK_SIZE = 500
+
+
+# saveAll估算语句大小时，为SQL文本和协议头预留的字节数
+PACKET_HEADROOM = 4096
+
+
 # 工具函数，构建insert语句占位符
 def create_args_string(num):
     L = []
@@ -183,8 +665,15 @@ class ModelMetaclass(type):
         # 构造默认的CRUD操作语句
         attrs['__select__'] = 'select `%s`, %s from `%s`' % (primaryKey, ', '.join(escaped_fields), tableName)
         attrs['__insert__'] = 'insert into `%s` (%s, `%s`) values (%s)' % (tableName, ', '.join(escaped_fields), primaryKey, create_args_string(len(escaped_fields) + 1))
+        # 多行insert语句的前缀和单行占位符，用于saveAll拼接
+        attrs['__insert_prefix__'] = 'insert into `%s` (%s, `%s`) values ' % (tableName, ', '.join(escaped_fields), primaryKey)
+        attrs['__insert_row__'] = '(%s)' % create_args_string(len(escaped_fields) + 1)
         attrs['__update__'] = 'update `%s` set %s where `%s`=?' % (tableName, ', '.join(map(lambda f: '`%s`=?' % (mappings.get(f).name or f), fields)), primaryKey)
         attrs['__delete__'] = 'delete from `%s` where `%s`=?' % (tableName, primaryKey)
+        # 按fields/exclude组合缓存的部分列select语句
+        attrs['__select_cache__'] = dict()
+        # 按更新的列集合缓存的部分列update语句
+        attrs['__update_cache__'] = dict()
         return type.__new__(cls, name, bases, attrs)
 
 
@@ -192,6 +681,11 @@ class ModelMetaclass(type):
 # Model类的子类映射数据库表
 class Model(dict, metaclass=ModelMetaclass):
     """docstring for Model"""
+    # 查询时未加载(延迟加载)的字段
+    _deferred = ()
+    # 从数据库加载或写入后修改过的字段，None表示不是从数据库加载的对象，update时更新全部字段
+    _dirty = None
+
     def __init__(self, **kw):
         super(Model, self).__init__(**kw)
 
@@ -202,6 +696,16 @@ class Model(dict, metaclass=ModelMetaclass):
                 raise AttributeError(r"'Model' object has no attribute '%s'" % key)
 
     def __setattr__(self, key, value):
+        # 从数据库加载的对象只记录值有变化的映射字段
+        if key in self.__mappings__ and self._dirty is not None and (key not in self or self[key] != value):
+            # update按主键定位记录，已加载的对象不能修改主键
+            if key == self.__primaty_key__:
+                raise AttributeError('Primary key of a loaded %s cannot be changed.' % self.__class__.__name__)
+            self._dirty.add(key)
+            # 会话中的对象标记为待写入
+            session = current_session()
+            if session is not None:
+                session.mark_dirty(self)
         self[key] = value
 
     def getValue(self, key):
@@ -218,11 +722,44 @@ class Model(dict, metaclass=ModelMetaclass):
         return value
 
     # 类方法
-    # 根据where条件查找
+    # 根据fields/exclude构造只查询部分列的select语句，返回(select语句, 未加载字段)
+    # 主键总是被查询，按字段组合缓存
     @classmethod
-    async def findAll(cls, where=None, args=None, **kw):
-        ' find objects by where clause. '
-        sql = [cls.__select__]
+    def _selectFor(cls, fields=None, exclude=None):
+        if fields is None and exclude is None:
+            return cls.__select__, ()
+        key = (tuple(fields) if fields is not None else None, tuple(exclude or ()))
+        if key not in cls.__select_cache__:
+            for f in tuple(fields or ()) + tuple(exclude or ()):
+                if f not in cls.__mappings__:
+                    raise ValueError('Invalid field name: %s' % f)
+            selected = [f for f in cls.__fields__ if (fields is None or f in fields) and f not in (exclude or ())]
+            deferred = tuple(f for f in cls.__fields__ if f not in selected)
+            sql = 'select %s from `%s`' % (', '.join(map(lambda f: '`%s`' % f, [cls.__primaty_key__] + selected)), cls.__table__)
+            cls.__select_cache__[key] = (sql, deferred)
+        return cls.__select_cache__[key]
+
+    # 类方法
+    # 由查询结果构造对象，并记录未加载的字段
+    # 有会话且identity为True时返回身份映射中的对象
+    @classmethod
+    def _fromRow(cls, row, deferred=(), identity=True):
+        obj = cls(**row)
+        if deferred:
+            object.__setattr__(obj, '_deferred', deferred)
+        obj._markClean()
+        if identity:
+            session = current_session()
+            if session is not None:
+                obj = session.add(obj)
+        return obj
+
+    # 类方法
+    # 根据where条件、orderBy、limit、fields/exclude构造select语句和参数
+    @classmethod
+    def _buildSelect(cls, where=None, args=None, **kw):
+        select_sql, deferred = cls._selectFor(kw.get('fields', None), kw.get('exclude', None))
+        sql = [select_sql]
         if where:
             sql.append('where')
             sql.append(where)
@@ -243,32 +780,131 @@ class Model(dict, metaclass=ModelMetaclass):
                 args.extend(limit)
             else:
                 raise ValueError('Invalid limit value: %s' % str(limit))
-        rs = await select(' '.join(sql), args)
-        return [cls(**r) for r in rs]
+        return ' '.join(sql), args, deferred
+
+    # 类方法
+    # 根据where条件查找
+    @classmethod
+    async def findAll(cls, where=None, args=None, **kw):
+        ' find objects by where clause. '
+        sql, args, deferred = cls._buildSelect(where, args, **kw)
+        rs = await select(sql, args)
+        return [cls._fromRow(r, deferred) for r in rs]
+
+    # 类方法
+    # 键集(keyset)分页查找，按(key, 主键)降序排列
+    # after=(key值, 主键值)时返回其后(更旧)的记录，before=(key值, 主键值)时返回其前(更新)的记录
+    # 多查询一条用于判断是否还有更多，返回(对象列表, 是否还有更多)
+    @classmethod
+    async def findSeek(cls, where=None, args=None, after=None, before=None, limit=10, key='created_at', **kw):
+        ' find objects by keyset pagination on (key, primary key). '
+        pk = cls.__primaty_key__
+        conds = ['(%s)' % where] if where else []
+        args = list(args or [])
+        order = 'desc'
+        if after is not None:
+            conds.append('(`%s` < ? or (`%s` = ? and `%s` < ?))' % (key, key, pk))
+            args.extend([after[0], after[0], after[1]])
+        elif before is not None:
+            conds.append('(`%s` > ? or (`%s` = ? and `%s` > ?))' % (key, key, pk))
+            args.extend([before[0], before[0], before[1]])
+            order = 'asc'
+        kw['orderBy'] = '`%s` %s, `%s` %s' % (key, order, pk, order)
+        kw['limit'] = limit + 1
+        rs = await cls.findAll(' and '.join(conds) or None, args, **kw)
+        has_more = len(rs) > limit
+        rs = rs[:limit]
+        if order == 'asc':
+            rs.reverse()
+        return rs, has_more
+
+    # 类方法
+    # 根据where条件流式查找，返回orm.SelectStream，用法:
+    # async with Blog.iterate(where, args, batch=500) as blogs:
+    #     async for blog in blogs:
+    # 结果不加入会话的身份映射，避免整表保留在内存中，修改后需自行调用update()
+    @classmethod
+    def iterate(cls, where=None, args=None, batch=500, **kw):
+        ' iterate objects by where clause with a server-side cursor. '
+        sql, args, deferred = cls._buildSelect(where, args, **kw)
+        return select_iter(sql, args, batch, lambda r: cls._fromRow(r, deferred, identity=False))
 
     # 类方法
     # 根据where条件查找，但返回整数
+    # count(...)查询的结果会被缓存，approximate=True时不扫描表，使用information_schema中的统计行数(只支持不带where的count)
     @classmethod
-    async def findNumber(cls, selectField, where=None, args=None):
+    async def findNumber(cls, selectField, where=None, args=None, approximate=False):
         ' find number by select and where. '
-        sql = ['select %s _num_ from `%s`' % (selectField, cls.__table__)]
-        if where:
-            sql.append('where')
-            sql.append(where)
-        rs = await select(' '.join(sql), args, 1)
+        cached = selectField.replace(' ', '').lower().startswith('count(')
+        if approximate and (not cached or where):
+            raise ValueError('approximate only supports count without where clause.')
+        if cached:
+            key = (cls.__table__, '~' if approximate else selectField, where, tuple(args or ()))
+            num = get_cached_count(key)
+            if num is not None:
+                return num
+        if approximate:
+            rs = await select('select table_rows _num_ from information_schema.tables where table_schema=database() and table_name=?', [cls.__table__], 1)
+        else:
+            sql = ['select %s _num_ from `%s`' % (selectField, cls.__table__)]
+            if where:
+                sql.append('where')
+                sql.append(where)
+            rs = await select(' '.join(sql), args, 1)
         if len(rs) == 0:
             return None
-        return rs[0]['_num_']
+        num = rs[0]['_num_']
+        if cached and num is not None:
+            set_cached_count(key, num)
+        return num
 
     # 类方法
     # 根据主键查找
     @classmethod
-    async def find(cls, pk):
+    async def find(cls, pk, fields=None, exclude=None):
         ' find object by primary key. '
-        rs = await select('%s where `%s`=?' % (cls.__select__, cls.__primaty_key__), [pk], 1)
+        select_sql, deferred = cls._selectFor(fields, exclude)
+        # 身份映射中已有且已加载所需字段时不查询
+        session = current_session()
+        if session is not None:
+            obj = session.get(cls, pk)
+            if obj is not None and all(f in deferred for f in obj._deferred):
+                return obj
+        rs = await select('%s where `%s`=?' % (select_sql, cls.__primaty_key__), [pk], 1)
         if len(rs) == 0:
             return None
-        return cls(**rs[0])
+        return cls._fromRow(rs[0], deferred)
+
+    # 类方法
+    # 根据主键列表批量查找，按IN列表分批查询，结果顺序与输入一致，未找到的为None
+    @classmethod
+    async def findMany(cls, pks, chunk=IN_CHUNK_SIZE, fields=None, exclude=None):
+        ' find objects by a list of primary keys. '
+        select_sql, deferred = cls._selectFor(fields, exclude)
+        pks = list(pks)
+        found = dict()
+        # 去重后分批，每批一条select ... where pk in (...)
+        keys = list(dict.fromkeys(pks))
+        for i in range(0, len(keys), chunk):
+            part = keys[i:i + chunk]
+            rs = await select('%s where `%s` in (%s)' % (select_sql, cls.__primaty_key__, create_args_string(len(part))), part)
+            for r in rs:
+                found[str(r[cls.__primaty_key__])] = r
+        return [cls._fromRow(found[str(pk)], deferred) if str(pk) in found else None for pk in pks]
+
+    # 实例方法
+    # 加载查询时未加载的字段，不指定字段时加载全部
+    async def load(self, *names):
+        names = [f for f in (names or self._deferred) if f in self._deferred]
+        if not names:
+            return self
+        rs = await select('select %s from `%s` where `%s`=?' % (', '.join(map(lambda f: '`%s`' % f, names)), self.__table__, self.__primaty_key__), [self.getValue(self.__primaty_key__)], 1)
+        if len(rs) == 0:
+            raise ValueError('Record not found: %s' % self.getValue(self.__primaty_key__))
+        for f in names:
+            self[f] = rs[0][f]
+        object.__setattr__(self, '_deferred', tuple(f for f in self._deferred if f not in names))
+        return self
 
     # 实例方法
     # 保存
@@ -276,15 +912,89 @@ class Model(dict, metaclass=ModelMetaclass):
         args = list(map(self.getValueOrDefault, self.__fields__))
         args.append(self.getValueOrDefault(self.__primaty_key__))
         rows = await execute(self.__insert__, args)
+        self._markClean()
+        clear_count_cache(self.__table__)
+        notify('insert', self)
         if rows != 1:
             logging.warn('failed to insert record: affected rows: %s' % rows)
 
+    # 类方法
+    # 批量保存，拼接多行insert语句，单条语句大小不超过max_allowed_packet，整批在一个事务中执行
+    @classmethod
+    async def saveAll(cls, instances, max_packet=None):
+        ' insert objects by multi-row insert statements in one transaction. '
+        if max_packet is None:
+            max_packet = await get_max_allowed_packet()
+        limit = max_packet - PACKET_HEADROOM
+        instances = list(instances)
+        statements = []
+        rows, args, size = [], [], len(cls.__insert_prefix__)
+        for obj in instances:
+            values = list(map(obj.getValueOrDefault, cls.__fields__))
+            values.append(obj.getValueOrDefault(cls.__primaty_key__))
+            # 按值的字节数估算，转义后最多翻倍，另加引号和逗号
+            row_size = sum(2 * len(str(v).encode('utf-8')) + 4 for v in values)
+            if rows and size + row_size > limit:
+                statements.append((cls.__insert_prefix__ + ', '.join(rows), args))
+                rows, args, size = [], [], len(cls.__insert_prefix__)
+            rows.append(cls.__insert_row__)
+            args.extend(values)
+            size += row_size
+        if rows:
+            statements.append((cls.__insert_prefix__ + ', '.join(rows), args))
+        if not statements:
+            return 0
+        try:
+            rows = await execute_batch(statements)
+        finally:
+            clear_count_cache(cls.__table__)
+        notify('insert', *instances)
+        return rows
+
+    # 类方法
+    # 只更新部分列的update语句，返回(update语句, 列的顺序)，按列集合缓存
+    @classmethod
+    def _updateFor(cls, fields):
+        key = frozenset(fields)
+        if key not in cls.__update_cache__:
+            ordered = [f for f in cls.__fields__ if f in key]
+            sql = 'update `%s` set %s where `%s`=?' % (cls.__table__, ', '.join(map(lambda f: '`%s`=?' % (cls.__mappings__[f].name or f), ordered)), cls.__primaty_key__)
+            cls.__update_cache__[key] = (sql, ordered)
+        return cls.__update_cache__[key]
+
+    # 实例方法
+    # 已与数据库一致，开始记录修改的字段
+    def _markClean(self):
+        object.__setattr__(self, '_dirty', set())
+
+    # 实例方法
+    # 构造update语句和参数，返回(sql, args)，没有修改过的字段时返回None
+    # 从数据库加载的对象只更新修改过的字段，其他对象更新全部字段
+    def _updateStatement(self):
+        if self._dirty is None:
+            sql, fields = self.__update__, self.__fields__
+        elif not self._dirty:
+            return None
+        else:
+            sql, fields = self._updateFor(self._dirty)
+        args = list(map(self.getValue, fields))
+        args.append(self.getValue(self.__primaty_key__))
+        return sql, args
+
     # 实例方法
     # 更新
     async def update(self):
-        args = list(map(self.getValue, self.__fields__))
-        args.append(self.getValue(self.__primaty_key__))
-        rows = await execute(self.__update__, args)
+        statement = self._updateStatement()
+        if statement is None:
+            logging.debug('no changed field to update: %s' % self.getValue(self.__primaty_key__))
+            return
+        rows = await execute(*statement)
+        self._markClean()
+        session = current_session()
+        if session is not None:
+            session.discard(self)
+        clear_count_cache(self.__table__)
+        notify('update', self)
         if rows != 1:
             logging.warn('failed to update by primary key: affected rows: %s' % rows)
 
@@ -293,5 +1003,10 @@ class Model(dict, metaclass=ModelMetaclass):
     async def remove(self):
         args = [self.getValue(self.__primaty_key__)]
         rows = await execute(self.__delete__, args)
+        session = current_session()
+        if session is not None:
+            session.discard(self, evict=True)
+        clear_count_cache(self.__table__)
+        notify('delete', self)
         if rows != 1:
             logging.warn('faild to remove by primary key: affected rows: %s' % rows)
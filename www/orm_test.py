@@ -46,6 +46,28 @@ async def test_findAll(loop):
     await closeDB()
 
 
+async def test_findSeek(loop):
+    await connectDB(loop)
+    users, has_more = await User.findSeek(limit=2, key='name')    # 按(name, id)降序的第一页
+    print('test_findSeek ==> first page: %s, has_more: %s' % (users, has_more))
+    if users:
+        last = users[-1]
+        users, has_more = await User.findSeek(after=(last.name, last.id), limit=2, key='name')
+        print('test_findSeek ==> next page: %s, has_more: %s' % (users, has_more))
+    await closeDB()
+
+
+async def test_iterate(loop):
+    await connectDB(loop)
+    async for user in User.iterate(orderBy='name', batch=2):    # 服务端游标，每次读取2行，读完后归还连接
+        print('test_iterate ==> user: %s' % user)
+    async with User.iterate(orderBy='name', batch=2) as users:    # 中途退出时关闭连接，不读取剩余的行
+        async for user in users:
+            print('test_iterate ==> first user: %s' % user)
+            break
+    await closeDB()
+
+
 async def test_findNumber(loop):
     await connectDB(loop)
     id = await User.findNumber('id')
@@ -63,6 +85,22 @@ async def test_find(loop):
     await closeDB()
 
 
+async def test_find_fields(loop):
+    await connectDB(loop)
+    user = await User.find('1', exclude=['password'])    # 不查询password列
+    print('test_find_fields ==> user: %s' % user)
+    await user.load('password')    # 按需加载未查询的列
+    print('test_find_fields ==> loaded user: %s' % user)
+    await closeDB()
+
+
+async def test_findMany(loop):
+    await connectDB(loop)
+    users = await User.findMany(['1', '2', '404', '1'])    # 按输入顺序返回，未找到的为None
+    print('test_findMany ==> users: %s' % users)
+    await closeDB()
+
+
 async def test_save(loop):
     await connectDB(loop)
     user = await User.find('5')    # 检查要存的主键是否存在
@@ -73,11 +111,54 @@ async def test_save(loop):
     await closeDB()
 
 
+async def test_saveAll(loop):
+    await connectDB(loop)
+    users = [User(id=100 + i, name='U%d' % i, email='u%d@qj-vr.com' % i, password='u123') for i in range(3)]
+    rows = await User.saveAll(users)    # 多行insert，同一事务
+    print('test_saveAll ==> affected rows: %s' % rows)
+    await closeDB()
+
+
+async def test_n_plus_one(loop):
+    await connectDB(loop)
+    orm.configure(n_plus_one_threshold=2, n_plus_one_strict=True)
+    stats, token = orm.begin_query_stats()
+    try:
+        for id in ('1', '2', '3'):
+            await User.find(id)    # 同一语句以3个不同参数执行，超过阈值2
+        orm.check_n_plus_one(stats)
+    except orm.NPlusOneError as e:
+        print('test_n_plus_one ==> detected: %s' % e)
+    else:
+        raise AssertionError('test_n_plus_one ==> not detected')
+    finally:
+        orm.end_query_stats(token)
+        orm.configure(n_plus_one_threshold=0, n_plus_one_strict=False)
+    await closeDB()
+
+
+async def test_unit_of_work(loop):
+    await connectDB(loop)
+
+    @orm.unit_of_work
+    async def rename(id, name):
+        user = await User.find(id)
+        same = await User.find(id)    # 身份映射中已有，不再查询
+        print('test_unit_of_work ==> same object: %s' % (user is same))
+        if user is not None:
+            user.name = name    # 返回后在一个事务中写入
+        return user
+
+    user = await rename('5', 'DY')
+    print('test_unit_of_work ==> user: %s' % user)
+    await closeDB()
+
+
 async def test_update(loop):
     await connectDB(loop)
     user = await User.find('5')
     if user is not None:
-        user.name = 'DY'
+        user.name = 'DY'    # 只更新修改过的name列
         await user.update()
         print('test_update ==> user: %s', user)
     await closeDB()
@@ -94,9 +175,16 @@ async def test_remove(loop):
 loop = asyncio.get_event_loop()
 
 loop.run_until_complete(test_findAll(loop))
+loop.run_until_complete(test_findSeek(loop))
+loop.run_until_complete(test_iterate(loop))
 loop.run_until_complete(test_findNumber(loop))
 loop.run_until_complete(test_find(loop))
+loop.run_until_complete(test_find_fields(loop))
+loop.run_until_complete(test_findMany(loop))
 loop.run_until_complete(test_save(loop))
+loop.run_until_complete(test_saveAll(loop))
+loop.run_until_complete(test_n_plus_one(loop))
+loop.run_until_complete(test_unit_of_work(loop))
 loop.run_until_complete(test_update(loop))
 loop.run_until_complete(test_remove(loop))
 
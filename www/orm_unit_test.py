@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+orm.py 中不需要数据库的逻辑的测试，select/execute_batch用假函数替换
+运行: python3 orm_unit_test.py 或 pytest orm_unit_test.py
+"""
+
+import asyncio
+import orm
+from orm import Model, StringField, TextField
+
+__author__ = 'Will Wei'
+
+
+class Blog(Model):
+    """docstring for Blog"""
+    __table__ = 'blogs'
+
+    id = StringField(primary_key=True)
+    name = StringField()
+    content = TextField()
+
+
+class FakeDB(object):
+    """
+    Replace orm.select/orm.execute_batch, record the statements.
+    """
+    def __init__(self):
+        self.selects = []
+        self.batches = []
+
+    async def select(self, sql, args, size=None):
+        self.selects.append((sql, args))
+        return [dict(id=args[0], name='name', content='content')]
+
+    async def execute_batch(self, statements):
+        self.batches.append(statements)
+        return len(statements)
+
+    def __enter__(self):
+        self._saved = orm.select, orm.execute_batch
+        orm.select, orm.execute_batch = self.select, self.execute_batch
+        return self
+
+    def __exit__(self, *exc):
+        orm.select, orm.execute_batch = self._saved
+
+
+class FakeCursor(object):
+    """docstring for FakeCursor"""
+    def __init__(self, rows):
+        self.rows = rows
+        self.closed = False
+
+    async def execute(self, sql, args):
+        pass
+
+    async def fetchmany(self, size):
+        rs, self.rows = self.rows[:size], self.rows[size:]
+        return rs
+
+    async def close(self):
+        # SSCursor.close会读取剩余的行
+        self.rows = []
+        self.closed = True
+
+
+class FakePool(object):
+    """
+    Replace the orm pool for SelectStream, connections return FakeCursor.
+    """
+    def __init__(self, rows):
+        self.rows = rows
+        self.released = []
+
+    async def acquire(self):
+        pool = self
+
+        class Conn(object):
+            closed = False
+
+            async def cursor(self, cls):
+                self.cur = FakeCursor(list(pool.rows))
+                return self.cur
+
+            def close(self):
+                self.closed = True
+        return Conn()
+
+    async def release(self, conn):
+        self.released.append(conn)
+
+    def __enter__(self):
+        self._saved = orm._get_pool
+        orm._get_pool = lambda: self
+        return self
+
+    def __exit__(self, *exc):
+        orm._get_pool = self._saved
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_iterate_to_the_end():
+    async def read():
+        return [blog async for blog in Blog.iterate(batch=2)]
+    with FakePool([dict(id=str(i), name='n', content='c') for i in range(5)]) as pool:
+        blogs = run(read())
+    assert [b.id for b in blogs] == ['0', '1', '2', '3', '4']
+    assert isinstance(blogs[0], Blog)
+    conn, = pool.released
+    assert conn.cur.closed and not conn.closed
+
+
+def test_iterate_break_closes_connection():
+    async def read():
+        async with Blog.iterate(batch=2) as blogs:
+            async for blog in blogs:
+                return blog
+    with FakePool([dict(id=str(i), name='n', content='c') for i in range(5)]) as pool:
+        blog = run(read())
+    assert blog.id == '0'
+    conn, = pool.released
+    # 关闭连接，不通过游标读取剩余的行
+    assert conn.closed and not conn.cur.closed and len(conn.cur.rows) == 3
+
+
+def test_saveAll_notifies_once():
+    calls = []
+    orm.add_listener('blogs', lambda action, blogs: calls.append((action, len(blogs))))
+    try:
+        with FakeDB() as db:
+            run(Blog.saveAll([Blog(id=str(i), name='n', content='c') for i in range(3)], max_packet=1 << 20))
+    finally:
+        orm._listeners['blogs'].pop()
+    assert len(db.batches) == 1
+    assert calls == [('insert', 3)]
+
+
+def test_identity_map():
+    async def handler():
+        session, token = orm.begin_session()
+        try:
+            a = await Blog.find('1')
+            b = await Blog.find('1')
+            c = (await Blog.findAll('id=?', ['1']))[0]
+            return a, b, c
+        finally:
+            orm.end_session(token)
+    with FakeDB() as db:
+        a, b, c = run(handler())
+    assert a is b and b is c
+    # 第二次find不查询，findAll查询但返回同一个对象
+    assert len(db.selects) == 2
+
+
+def test_unit_of_work_flushes_changed_fields():
+    @orm.unit_of_work
+    async def handler():
+        blog = await Blog.find('1')
+        blog.name = 'new'
+        blog.content = 'content'    # 值未变化，不写入
+        return blog
+    with FakeDB() as db:
+        run(handler())
+    assert db.batches == [[('update `blogs` set `name`=? where `id`=?', ['new', '1'])]]
+
+
+def test_unit_of_work_error_does_not_flush():
+    @orm.unit_of_work
+    async def handler():
+        blog = await Blog.find('1')
+        blog.name = 'new'
+        raise ValueError('name')
+    with FakeDB() as db:
+        try:
+            run(handler())
+        except ValueError:
+            pass
+        else:
+            assert False, 'ValueError not raised'
+    assert db.batches == []
+
+
+def test_session_without_unit_does_not_track():
+    async def handler():
+        session, token = orm.begin_session()
+        try:
+            blog = await Blog.find('1')
+            blog.name = 'new'
+            return session
+        finally:
+            orm.end_session(token)
+    with FakeDB():
+        session = run(handler())
+    assert session.dirty == {}
+
+
+def test_primary_key_of_loaded_model_is_read_only():
+    async def load():
+        return await Blog.find('1')
+    with FakeDB():
+        blog = run(load())
+    blog.id = '1'    # 值未变化
+    try:
+        blog.id = '2'
+    except AttributeError:
+        pass
+    else:
+        assert False, 'AttributeError not raised'
+    assert blog.id == '1' and not blog._dirty
+    # 新建的对象可以设置主键
+    Blog(name='name').id = '3'
+
+
+class NPlusOneSettings(object):
+    """
+    Turn on N+1 detection with the given threshold, restore the settings on exit.
+    """
+    def __init__(self, threshold, strict=False):
+        self.kw = dict(n_plus_one_threshold=threshold, n_plus_one_strict=strict)
+
+    def __enter__(self):
+        self._saved = dict((k, orm.settings[k]) for k in self.kw)
+        orm.configure(**self.kw)
+
+    def __exit__(self, *exc):
+        orm.configure(**self._saved)
+
+
+# 与select()相同，通过run_query_hooks记录语句
+def run_statements(statements):
+    stats, token = orm.begin_query_stats()
+    try:
+        for sql, args in statements:
+            orm.run_query_hooks(sql, args, 0.001, 1)
+        return stats, orm.check_n_plus_one(stats)
+    finally:
+        orm.end_query_stats(token)
+
+
+FIND_USER = 'select `id`, `name` from `users` where `id`=?'
+
+
+def test_statement_template():
+    assert orm.statement_template('select *\n  from t where id in (?, ?, ?)') == 'select * from t where id in (...)'
+    assert orm.statement_template('insert into t (a, b) values (?, ?), (?, ?)') == 'insert into t (a, b) values (...)'
+
+
+def test_n_plus_one_detected():
+    with NPlusOneSettings(2):
+        stats, repeated = run_statements([(FIND_USER, [str(i)]) for i in range(3)])
+    assert stats.count == 3
+    assert repeated == [(FIND_USER, 3)]
+
+
+def test_n_plus_one_below_threshold():
+    with NPlusOneSettings(2):
+        stats, repeated = run_statements([(FIND_USER, ['1']), (FIND_USER, ['2'])])
+    assert repeated == []
+    # 相同参数的重复执行不是N+1
+    with NPlusOneSettings(2):
+        stats, repeated = run_statements([(FIND_USER, ['1'])] * 5)
+    assert repeated == []
+
+
+def test_n_plus_one_disabled():
+    with NPlusOneSettings(0):
+        stats, repeated = run_statements([(FIND_USER, [str(i)]) for i in range(10)])
+    assert repeated == [] and stats.templates == {}
+
+
+def test_n_plus_one_strict_raises():
+    with NPlusOneSettings(2, strict=True):
+        try:
+            run_statements([(FIND_USER, [str(i)]) for i in range(3)])
+        except orm.NPlusOneError as e:
+            assert FIND_USER in str(e)
+        else:
+            assert False, 'NPlusOneError not raised'
+
+
+def test_unit_of_work_without_contextvars():
+    # Python 3.6没有contextvars时使用_TaskVar
+    saved = orm._session
+    orm._session = orm._TaskVar('session')
+    try:
+        test_identity_map()
+        test_unit_of_work_flushes_changed_fields()
+        assert orm.current_session() is None
+    finally:
+        orm._session = saved
+
+
+if __name__ == '__main__':
+    for name, fn in sorted(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print('%s ==> ok' % name)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Pre-fork worker supervisor
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import stat
+import logging
+import threading
+
+__author__ = 'Will Wei'
+
+
+# 创建监听socket，reuse_port为True时设置SO_REUSEPORT，多个进程各自绑定同一端口，由内核分配连接
+# asyncio会为每个接受的连接设置TCP_NODELAY，这里不需要设置
+def bind_socket(host, port, reuse_port=False, backlog=128):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+# 创建Unix domain socket，供本机的反向代理连接，删除上次遗留的socket文件
+def bind_unix_socket(path, backlog=128):
+    # 只删除上次运行留下的socket文件，不删除配置错误指向的普通文件
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        pass
+    else:
+        if not stat.S_ISSOCK(mode):
+            raise ValueError('%s exists and is not a socket' % path)
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+# 父进程退出(包括被SIGKILL)时向当前进程发送SIGTERM，避免孤儿worker继续占用端口
+# Linux上使用prctl(PR_SET_PDEATHSIG)，其他系统每interval秒检查一次父进程
+def exit_with_parent(parent, interval=1):
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        # PR_SET_PDEATHSIG = 1
+        if libc.prctl(1, signal.SIGTERM, 0, 0, 0) != 0:
+            raise OSError(ctypes.get_errno(), 'prctl failed')
+    except (OSError, AttributeError):
+        def watch():
+            while os.getppid() == parent:
+                time.sleep(interval)
+            os.kill(os.getpid(), signal.SIGTERM)
+        threading.Thread(target=watch, name='parent-watcher', daemon=True).start()
+    # fork之后、设置之前父进程已经退出
+    if os.getppid() != parent:
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+class Supervisor(object):
+    """
+    Fork workers and keep them running.
+    worker(sock) runs in each child process and returns when the worker stops.
+    If SO_REUSEPORT is available every worker binds its own socket,
+    otherwise all workers inherit one socket bound by the parent.
+    SIGTERM/SIGINT stop the workers gracefully, crashed workers are restarted.
+    """
+    def __init__(self, worker, workers, host, port, reuse_port=True, backlog=128):
+        self.worker = worker
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port and hasattr(socket, 'SO_REUSEPORT')
+        self.backlog = backlog
+        self.children = dict()
+        self.stopping = False
+        self.sock = None
+
+    def spawn(self, index):
+        parent = os.getpid()
+        pid = os.fork()
+        if pid:
+            self.children[pid] = index
+            return
+        # 子进程：恢复默认信号处理，由worker自己处理SIGTERM
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # supervisor被杀死(如pymonitor.py的kill)时worker随之停止
+        exit_with_parent(parent)
+        # worker序号，重启后不变，用于指标标签和单独的指标端口
+        os.environ['WORKER_INDEX'] = str(index)
+        code = 0
+        try:
+            sock = self.sock or bind_socket(self.host, self.port, True, self.backlog)
+            self.worker(sock)
+        except Exception as e:
+            logging.exception(e)
+            code = 1
+        finally:
+            os._exit(code)
+
+    def stop(self, signum, frame):
+        logging.info('supervisor got signal %s, stopping %s workers...' % (signum, len(self.children)))
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        if not self.reuse_port:
+            self.sock = bind_socket(self.host, self.port, False, self.backlog)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+        logging.info('supervisor %s started %s workers on %s:%s (%s)' % (os.getpid(), self.workers, self.host, self.port, 'SO_REUSEPORT' if self.reuse_port else 'shared socket'))
+        started = dict()
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                break
+            index = self.children.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            logging.warning('worker %s (pid %s) exited with status %s, restarting...' % (index, pid, status))
+            # 避免worker启动即崩溃时频繁重启
+            if time.time() - started.get(index, 0) < 1:
+                time.sleep(1)
+            started[index] = time.time()
+            self.spawn(index)
+        logging.info('supervisor stopped.')
+        sys.exit(0)
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+回填日志的html_content
+已有数据库先添加列：
+    alter table blogs add column `html_content` mediumtext after `content`;
+然后运行：
+    $ python3 render_blogs.py          只渲染html_content为空的日志
+    $ python3 render_blogs.py --all    重新渲染全部日志
+"""
+
+import sys
+import asyncio
+import logging
+import orm
+from models import Blog
+from config import configs
+from handlers import blog2html
+logging.basicConfig(level=logging.INFO)
+
+__author__ = 'Will Wei'
+
+
+async def backfill(loop, all=False):
+    await orm.create_pool(loop=loop, **configs.db)
+    where = None if all else '`html_content` is null'
+    n = 0
+    async with Blog.iterate(where, batch=100) as blogs:
+        async for blog in blogs:
+            blog.html_content = blog2html(blog.content)
+            await blog.update()
+            n = n + 1
+    logging.info('rendered blogs: %s' % n)
+    await orm.destory_pool()
+
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(backfill(loop, '--all' in sys.argv[1:]))
+    loop.close()
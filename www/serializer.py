@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+JSON serializer for responses
+"""
+
+import json
+from apis import APIError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__author__ = 'Will Wei'
+
+
+# 非json原生类型的转换
+# Model是dict的子类，可以直接序列化；Page、CursorPage等对象转为属性字典
+def default(o):
+    if isinstance(o, APIError):
+        return dict(error=o.error, data=o.data, message=o.message)
+    if hasattr(o, '__dict__'):
+        return o.__dict__
+    raise TypeError('Object of type %s is not JSON serializable' % o.__class__.__name__)
+
+
+_encoder = json.JSONEncoder(ensure_ascii=False, default=default, separators=(',', ':'))
+
+
+# 序列化为utf-8编码的bytes，安装了orjson时使用orjson
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=default)
+    return _encoder.encode(obj).encode('utf-8')
+
+
+# 当前使用的json实现
+backend = 'orjson' if orjson is not None else 'json'
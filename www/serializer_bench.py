@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+/api/blogs响应序列化的基准测试
+对比原来的json.dumps(default=lambda o: o.__dict__)和serializer.dumps
+$ python3 serializer_bench.py
+"""
+
+import json
+import time
+import timeit
+import serializer
+from models import Blog, next_id
+from apis import Page
+
+__author__ = 'Will Wei'
+
+
+# 构造一页/api/blogs的返回结果，列表页不包含content
+def make_result(page_size=10):
+    blogs = [Blog(id=next_id(), user_id=next_id(), user_name='Will Wei', user_image='http://www.gravatar.com/avatar/0?d=mm&s=120',
+                  name='日志标题 %s' % i, summary='摘要 ' * 40, created_at=time.time()) for i in range(page_size)]
+    return dict(page=Page(1000, 1, page_size), blogs=blogs)
+
+
+def legacy_dumps(r):
+    return json.dumps(r, ensure_ascii=False, default=lambda o: o.__dict__).encode('utf-8')
+
+
+def bench(page_size, number=20000):
+    r = make_result(page_size)
+    for label, fn in (('before', legacy_dumps), ('after(%s)' % serializer.backend, serializer.dumps)):
+        size = len(fn(r))
+        t = timeit.timeit(lambda: fn(r), number=number)
+        print('page_size %-4s %-14s %8.2f us/response %8.1f MB/s' % (page_size, label, t / number * 1e6, size * number / t / 1e6))
+
+
+if __name__ == '__main__':
+    bench(10)
+    bench(100, 2000)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+/api/blogs的每秒请求数基准测试
+分别以不同的configs.server设置(uvloop、backlog、keepalive_timeout、unix_socket)启动app.py，
+然后对每个地址运行本脚本，比较结果：
+$ python3 server_bench.py asyncio=http://127.0.0.1:9000/api/blogs uvloop=http://127.0.0.1:9001/api/blogs unix=unix:/tmp/awesome.sock:/api/blogs
+可选参数：-c 并发连接数(默认50)，-d 每个地址的测试秒数(默认10)
+"""
+
+import sys
+import time
+import asyncio
+import aiohttp
+
+__author__ = 'Will Wei'
+
+
+# 解析target，格式为[名称=]URL，Unix domain socket为unix:socket路径:请求路径
+def parse_target(target):
+    name, sep, url = target.partition('=')
+    if not sep:
+        name, url = target, target
+    if url.startswith('unix:'):
+        path, sep, req = url[5:].partition(':')
+        return name, 'http://localhost' + (req or '/api/blogs'), path
+    return name, url, None
+
+
+async def worker(session, url, deadline, stats):
+    while time.time() < deadline:
+        start = time.time()
+        try:
+            async with session.get(url) as resp:
+                await resp.read()
+                stats['ok' if resp.status == 200 else 'errors'] += 1
+        except aiohttp.ClientError:
+            stats['errors'] += 1
+        stats['latency'] += time.time() - start
+
+
+async def bench(name, url, unix_path, concurrency, duration):
+    if unix_path:
+        connector = aiohttp.UnixConnector(path=unix_path, limit=concurrency)
+    else:
+        connector = aiohttp.TCPConnector(limit=concurrency)
+    stats = dict(ok=0, errors=0, latency=0.0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        deadline = time.time() + duration
+        await asyncio.gather(*[worker(session, url, deadline, stats) for i in range(concurrency)])
+    total = stats['ok'] + stats['errors']
+    print('%-16s %10.1f req/s %8.2f ms/req %6s errors' % (name, stats['ok'] / duration, stats['latency'] / max(total, 1) * 1000, stats['errors']))
+
+
+def main(argv):
+    concurrency, duration, targets = 50, 10, []
+    while argv:
+        arg = argv.pop(0)
+        if arg == '-c':
+            concurrency = int(argv.pop(0))
+        elif arg == '-d':
+            duration = float(argv.pop(0))
+        else:
+            targets.append(parse_target(arg))
+    if not targets:
+        targets.append(parse_target('default=http://127.0.0.1:9000/api/blogs'))
+    loop = asyncio.get_event_loop()
+    for name, url, unix_path in targets:
+        loop.run_until_complete(bench(name, url, unix_path, concurrency, duration))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Table versions shared by worker processes
+"""
+
+import os
+import mmap
+import struct
+
+__author__ = 'Will Wei'
+
+
+class Versions(object):
+    """
+    A random 64-bit token per name, kept in an anonymous shared mmap.
+    Create it before the supervisor forks, then every worker sees the tokens bumped by the others.
+    bump() writes a new random token instead of incrementing, so concurrent bumps never lose a change.
+    """
+    def __init__(self, names):
+        self.names = tuple(names)
+        self._index = dict((name, i) for i, name in enumerate(self.names))
+        self._mm = mmap.mmap(-1, 8 * len(self.names))
+        for name in self.names:
+            self.bump(name)
+
+    def get(self, *names):
+        return tuple(struct.unpack_from('Q', self._mm, 8 * self._index[name])[0] for name in names)
+
+    def bump(self, name):
+        # 各worker的random状态在fork时相同，使用os.urandom
+        struct.pack_into('Q', self._mm, 8 * self._index[name], struct.unpack('Q', os.urandom(8))[0])
+
+
+# 各表的版本，handlers中的orm监听在记录插入、更新、删除后更新
+# 在app.py导入时(fork之前)创建；不经过orm的写入(如render_blogs.py、手工SQL)不会更新版本
+versions = Versions(('blogs', 'comments', 'users'))
+
+
+# 页面内容的版本，任一表变化时改变
+def content_version():
+    return versions.get(*versions.names)